@@ -1,7 +1,8 @@
 import os
 import sys
 from datetime import datetime
-from database import get_connection
+from database import get_pooled_connection, put_pooled_connection, close_pool
+from rollups import refresh_rollups, fetch_rollup_watermark
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,8 +14,11 @@ def run_analytics(user_id_to_track=None):
     
     conn = None
     try:
-        conn = get_connection()
+        conn = get_pooled_connection()
+        refresh_rollups(conn)
         cur = conn.cursor()
+        last_id, rolled_up_at = fetch_rollup_watermark(conn)
+        print(f"Агрегаты до сообщения id {last_id} (обновлены {rolled_up_at.strftime('%Y-%m-%d %H:%M:%S')})")
 
         print("\n--- 1. СВОДКА ПО БАЗЕ ДАННЫХ И ПОЛЬЗОВАТЕЛЯМ ---")
         
@@ -24,11 +28,11 @@ def run_analytics(user_id_to_track=None):
         cur.execute("SELECT COUNT(*) FROM CopyPerfume")
         print(f"✅ Общее количество клонов: {cur.fetchone()[0]}")
 
-        cur.execute("SELECT COUNT(*) FROM UserMessages")
+        cur.execute("SELECT COALESCE(SUM(message_count), 0) FROM DailyUserActivity")
         total_messages = cur.fetchone()[0]
         print(f"✅ Общее количество сообщений (логом): {total_messages}")
 
-        cur.execute("SELECT COUNT(DISTINCT user_id) FROM UserMessages")
+        cur.execute("SELECT COUNT(DISTINCT user_id) FROM DailyUserActivity")
         unique_users = cur.fetchone()[0]
         print(f"✅ Уникальных пользователей: {unique_users}")
         
@@ -78,30 +82,43 @@ def run_analytics(user_id_to_track=None):
         
         cur.execute("""
             SELECT 
-                TRIM(SUBSTRING(notes FROM 'Found: (.*)')) AS found_perfume, 
-                COUNT(*) AS success_count
-            FROM UserMessages
-            WHERE status = 'success' AND notes LIKE 'Found: %%'
-            GROUP BY found_perfume
-            ORDER BY success_count DESC
-            LIMIT 10
+                o.brand, 
+                o.name, 
+                s.success_count,
+                s.fuzzy_count
+            FROM (
+                SELECT original_id, SUM(success_count) AS success_count, SUM(fuzzy_count) AS fuzzy_count
+                FROM DailySearchStats
+                GROUP BY original_id
+                ORDER BY success_count DESC
+                LIMIT 10
+            ) s
+            JOIN OriginalPerfume o ON o.id = s.original_id
+            ORDER BY s.success_count DESC
         """)
         top_searched = cur.fetchall()
         
         for i, row in enumerate(top_searched):
-            perfume_name = row['found_perfume'].split(' | NOTE: ')[0] 
-            print(f"  {i+1}. {perfume_name} | Успешных поисков: {row['success_count']}")
+            print(f"  {i+1}. {row['brand']} {row['name']} | Успешных поисков: {row['success_count']} | Нечетких: {row['fuzzy_count']}")
+
+        cur.execute("""
+            SELECT match_stage, SUM(message_count) AS stage_count
+            FROM DailyStageStats
+            GROUP BY match_stage
+            ORDER BY stage_count DESC
+        """)
+        stages = ", ".join(f"{row['match_stage']}: {row['stage_count']}" for row in cur.fetchall())
+        print(f"✅ Этапы совпадения: {stages or 'нет данных'}")
 
         print("\n--- 5. ТОП-10 НЕУСПЕШНЫХ ЗАПРОСОВ (Для добавления в базу) ---")
         
         cur.execute("""
             SELECT 
-                message, 
-                COUNT(*) AS fail_count,
-                MAX(notes) AS last_note
-            FROM UserMessages
-            WHERE status = 'fail' AND message NOT IN ('/start')
-            GROUP BY message
+                query_norm AS message, 
+                SUM(fail_count) AS fail_count,
+                (array_agg(last_note ORDER BY last_seen DESC))[1] AS last_note
+            FROM DailyFailStats
+            GROUP BY query_norm
             ORDER BY fail_count DESC
             LIMIT 10
         """)
@@ -116,9 +133,9 @@ def run_analytics(user_id_to_track=None):
         cur.execute("""
             SELECT 
                 user_id, 
-                COUNT(*) AS total_msgs,
-                MAX(timestamp) AS last_activity
-            FROM UserMessages
+                SUM(message_count) AS total_msgs,
+                MAX(last_activity) AS last_activity
+            FROM DailyUserActivity
             GROUP BY user_id
             ORDER BY total_msgs DESC
             LIMIT 5
@@ -138,19 +155,21 @@ def run_analytics(user_id_to_track=None):
             print("\n--- 7.1. УСПЕШНЫЕ ЗАПРОСЫ ПОЛЬЗОВАТЕЛЯ ---")
             cur.execute("""
                 SELECT 
-                    TRIM(SUBSTRING(notes FROM 'Found: (.*)')) AS found_perfume, 
+                    o.brand, 
+                    o.name, 
                     COUNT(*) AS success_count,
-                    MAX(timestamp) AS last_search
-                FROM UserMessages
-                WHERE status = 'success' AND notes LIKE 'Found: %%' AND user_id = %s
-                GROUP BY found_perfume
+                    MAX(m.timestamp) AS last_search
+                FROM UserMessages m
+                JOIN OriginalPerfume o ON o.id = m.original_id
+                WHERE m.user_id = %s AND m.status = 'success'
+                GROUP BY o.id, o.brand, o.name
                 ORDER BY success_count DESC
             """, (user_id_to_track,))
             user_success = cur.fetchall()
 
             if user_success:
                 for i, row in enumerate(user_success):
-                    perfume_name = row['found_perfume'].split(' | NOTE: ')[0]
+                    perfume_name = f"{row['brand']} {row['name']}"
                     last_search_dt = row['last_search'].strftime('%Y-%m-%d %H:%M:%S')
                     print(f"  {i+1}. {perfume_name} | Поисков: {row['success_count']} | Последний: {last_search_dt}")
             else:
@@ -184,7 +203,8 @@ def run_analytics(user_id_to_track=None):
         sys.exit(1)
     finally:
         if conn:
-            conn.close()
+            put_pooled_connection(conn)
+        close_pool()
         print("\n=============================================================")
         print("          ✨ АНАЛИТИКА ЗАВЕРШЕНА ✨")
         print("=============================================================")
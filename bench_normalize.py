@@ -0,0 +1,69 @@
+import csv
+import os
+import re
+import sys
+import timeit
+import unicodedata
+
+from utils import normalize_for_match, _normalize, _normalize_cached
+
+CSV_FILE = os.path.join('data', 'sources', 'perfumes_master.csv')
+TEXT_COLUMNS = ('og_brand', 'og_name', 'copy_brand', 'copy_name', 'notes')
+EXTRA_SAMPLES = [
+    "Диор Саваж", "Шанель №5", "  Tom   Ford\tOud  Wood ", "Çhypré — Éxtrait", "İstanbul",
+    "ＦＵＬＬＷＩＤＴＨ", "ﬁgue", "Щелкунчик Ёлка", "", None,
+]
+
+def reference_normalize(s):
+    """The original per-call implementation, kept only to check identical output."""
+    if not s:
+        return ""
+    s = re.sub(r"\s+", " ", s).strip()
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    table = {
+        "а":"a","б":"b","в":"v","г":"g","д":"d","е":"e","ё":"e","ж":"zh","з":"z","и":"i","й":"i",
+        "к":"k","л":"l","м":"m","н":"n","о":"o","п":"p","р":"r","с":"s","т":"t","у":"u","ф":"f",
+        "х":"kh","ц":"ts","ч":"ch","ш":"sh","щ":"shch","ъ":"","ы":"y","ь":"","э":"e","ю":"yu","я":"ya"
+    }
+    s_low = s.lower()
+    res = []
+    for ch in s_low:
+        res.append(table.get(ch, ch))
+    s = "".join(res)
+    s = re.sub(r"[^a-z0-9\s]", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+def load_corpus():
+    corpus = []
+    with open(CSV_FILE, mode='r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            corpus.extend(row.get(col) for col in TEXT_COLUMNS)
+            corpus.append(f"{row.get('og_brand')} {row.get('og_name')}")
+            corpus.append(f"{row.get('copy_brand')} {row.get('copy_name')}")
+    return corpus + EXTRA_SAMPLES
+
+def main():
+    corpus = load_corpus()
+    uncached = _normalize
+
+    mismatches = [s for s in corpus if normalize_for_match(s) != reference_normalize(s)]
+    mismatches += [s for s in corpus if uncached(s) != reference_normalize(s)]
+    print(f"Strings checked: {len(corpus)}, mismatches: {len(mismatches)}")
+    for s in mismatches[:10]:
+        print(f"  {s!r}: {normalize_for_match(s)!r} != {reference_normalize(s)!r}")
+
+    runs = 20
+    ref_time = timeit.timeit(lambda: [reference_normalize(s) for s in corpus], number=runs)
+    cold_time = timeit.timeit(lambda: [uncached(s) for s in corpus], number=runs)
+    _normalize_cached.cache_clear()
+    warm_time = timeit.timeit(lambda: [normalize_for_match(s) for s in corpus], number=runs)
+
+    per_call = lambda total: total / (runs * len(corpus)) * 1e6
+    print(f"reference:         {per_call(ref_time):.2f} us/call")
+    print(f"compiled, no memo: {per_call(cold_time):.2f} us/call")
+    print(f"compiled + memo:   {per_call(warm_time):.2f} us/call")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from rapidfuzz import process
+from rapidfuzz.fuzz import WRatio
+
+import search
+from i18n import get_message
+from utils import normalize_for_match
+
+DB_FILE = os.path.join('data', 'perfumes.db')
+SCALE_FACTORS = (1, 10, 100)
+TIMING_SAMPLE = 500
+EXTRA_QUERIES = [
+    "asdkjh qwe", "диор саваж", "Dior savage", "шанель", "tom ford", "xyz",
+    "creed aventus", "aventus creed", "Шанель №5", "  Tom   Ford\tOud  Wood ",
+]
+
+def load_rows():
+    conn = sqlite3.connect(DB_FILE)
+    conn.row_factory = sqlite3.Row
+    originals = [dict(r) for r in conn.execute("SELECT id, brand, name FROM OriginalPerfume")]
+    clones = [dict(r) for r in conn.execute(
+        "SELECT id, original_id, brand, name, price_eur, url, notes, saved_amount FROM CopyPerfume"
+    )]
+    conn.close()
+    return originals, clones
+
+def load_queries(originals, clones):
+    rnd = random.Random(7)
+    queries = []
+    for o in originals:
+        queries += [f"{o['brand']} {o['name']}", o["name"], f"{o['name']} {o['brand']}", o["brand"]]
+    for c in clones:
+        queries.append(f"{c['brand'] or ''} {c['name'] or ''}")
+    for q in rnd.sample(queries, min(800, len(queries))):
+        if q and len(q) > 4:
+            i = rnd.randrange(len(q))
+            queries.append(q[:i] + q[i + 1:])
+            j = rnd.randrange(len(q))
+            queries.append(q[:j] + rnd.choice("aeiou") + q[j:])
+    return [q for q in queries + EXTRA_QUERIES if q and q.strip()]
+
+class ReferenceMatcher:
+    """
+    The original find_original cascade: one full scan of the catalog per step.
+    extractOne returns the first best match at or above the cutoff, exactly
+    like the original loop, only faster.
+    """
+    def __init__(self, originals, clones):
+        self.catalog = [{
+            "id": r["id"],
+            "brand": r["brand"] or "",
+            "brand_norm": normalize_for_match(r["brand"]),
+            "name_norm": normalize_for_match(r["name"]),
+            "display_norm": normalize_for_match(f"{r['brand']} {r['name']}"),
+        } for r in originals]
+        self.by_id = {item["id"]: item for item in self.catalog}
+        self.clones = [{
+            "display_norm": normalize_for_match(f"{r['brand']} {r['name']}"),
+            "original_id": r["original_id"],
+        } for r in clones]
+        self.columns = {}
+
+    def _best(self, user_norm, space, key, min_score):
+        column = self.columns.get((id(space), key))
+        if column is None:
+            column = self.columns[(id(space), key)] = [item[key] for item in space]
+        if user_norm in column:
+            return space[column.index(user_norm)]
+        best = process.extractOne(user_norm, column, scorer=WRatio, score_cutoff=min_score)
+        return space[best[2]] if best else None
+
+    def find(self, user_norm, lang):
+        note = get_message("note_fuzzy_match", lang)
+        reversed_norm = " ".join(user_norm.split()[::-1])
+
+        match = self._best(user_norm, self.catalog, "display_norm", 100)
+        if match:
+            return {"ok": True, "original": match}
+        match = self._best(reversed_norm, self.catalog, "display_norm", 95)
+        if match:
+            return {"ok": True, "original": match, "note": note}
+        match = self._best(user_norm, self.catalog, "name_norm", 90)
+        if match:
+            return {"ok": True, "original": match}
+        clone = self._best(user_norm, self.clones, "display_norm", 80)
+        if clone and clone["original_id"] in self.by_id:
+            return {"ok": True, "original": self.by_id[clone["original_id"]]}
+        match = self._best(user_norm, self.catalog, "brand_norm", 90)
+        if match:
+            message = get_message("error_brand_only", lang).format(brand_name=match["brand"])
+            return {"ok": False, "message": message}
+        match = self._best(user_norm, self.catalog, "display_norm", 85)
+        if match:
+            return {"ok": True, "original": match, "note": note}
+        return {"ok": False, "message": get_message("error_not_found", lang)}
+
+def scale_rows(originals, clones, factor):
+    """
+    The catalog repeated `factor` times; every copy after the first gets a
+    numbered name, so all values stay distinct and share the real n-grams.
+    """
+    scaled_originals, scaled_clones = [], []
+    for k in range(factor):
+        suffix = f" {k}" if k else ""
+        scaled_originals += [{**r, "id": f"{r['id']}{suffix}", "name": f"{r['name']}{suffix}"}
+                             for r in originals]
+        scaled_clones += [{**r, "id": f"{r['id']}{suffix}", "original_id": f"{r['original_id']}{suffix}",
+                           "name": f"{r['name']}{suffix}"} for r in clones]
+    return scaled_originals, scaled_clones
+
+def time_scaled(originals, clones, queries, factors=SCALE_FACTORS, sample=TIMING_SAMPLE):
+    """Mean _match_original time per query as the catalog grows; it should stay flat."""
+    sample = [normalize_for_match(q) for q in random.Random(11).sample(queries, min(sample, len(queries)))]
+    timings = []
+    for factor in factors:
+        catalog = search.build_catalog(*scale_rows(originals, clones, factor))
+        started = time.perf_counter()
+        for user_norm in sample:
+            search._match_original(catalog, user_norm, "ru")
+        per_query = (time.perf_counter() - started) / len(sample) * 1000
+        timings.append(per_query)
+        print(f"  x{factor:<3} {len(catalog['originals']['id']):>6} originals: {per_query:.2f} ms/query")
+    return timings
+
+def outcome(result):
+    """What a user sees: the original found (or the message) and the fuzzy note."""
+    if result["ok"]:
+        return (True, result["original"]["id"], result.get("note"))
+    return (False, result["message"], None)
+
+def replay(catalog, reference, queries, lang="ru"):
+    mismatches = []
+    for q in queries:
+        user_norm = normalize_for_match(q)
+        got = outcome(search._match_original(catalog, user_norm, lang))
+        want = outcome(reference.find(user_norm, lang))
+        if got != want:
+            mismatches.append((q, got, want))
+    return mismatches
+
+def main():
+    """
+    Replays every catalog-derived query through search._match_original and the
+    original cascade. With n-gram pruning and brand-scoped matching switched off
+    the two must agree on every query; run this after changing MATCH_STAGES,
+    SCORE_ROWS or the catalog layout. The counts with both switched back on
+    show how many answers those two deliberate changes alter.
+
+    With --timing it instead measures search time on the catalog repeated
+    SCALE_FACTORS times, to check that n-gram pruning keeps it flat.
+    """
+    originals, clones = load_rows()
+    queries = load_queries(originals, clones)
+    if "--timing" in sys.argv[1:]:
+        print("Search time with the catalog scaled:")
+        time_scaled(originals, clones, queries)
+        return 0
+    reference = ReferenceMatcher(originals, clones)
+    catalog = search.build_catalog(originals, clones)
+
+    candidates, find_in_brand = search._candidates, search.find_in_brand
+    search._candidates = lambda user_norm, index, limit=None: None
+    search.find_in_brand = lambda *args, **kwargs: None
+    try:
+        started = time.perf_counter()
+        mismatches = replay(catalog, reference, queries)
+        elapsed = time.perf_counter() - started
+    finally:
+        search._candidates, search.find_in_brand = candidates, find_in_brand
+
+    print(f"Queries replayed: {len(queries)}, mismatches (no pruning, no brand scoping): "
+          f"{len(mismatches)} in {elapsed:.1f} s")
+    for q, got, want in mismatches[:10]:
+        print(f"  {q!r}: {got!r} != {want!r}")
+
+    search.find_in_brand = lambda *args, **kwargs: None
+    try:
+        pruned = len(replay(catalog, reference, queries))
+    finally:
+        search.find_in_brand = find_in_brand
+    print(f"Changed by n-gram pruning:             {pruned}")
+    print(f"Changed by pruning + brand scoping:    {len(replay(catalog, reference, queries))}")
+    return 1 if mismatches else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,132 @@
-from cachetools import cached, TTLCache
-from database import fetch_popular_originals, fetch_user_history, get_connection
+import os
+import time
+import threading
+from cachetools import TTLCache
+from database import fetch_popular_originals, fetch_user_history, pooled_connection
+from log_writer import add_flush_listener
 
-cache = TTLCache(maxsize=100, ttl=3600)
+HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", 300))
+HISTORY_CACHE_MAXSIZE = int(os.getenv("HISTORY_CACHE_MAXSIZE", 10000))
+POPULAR_CACHE_TTL = int(os.getenv("POPULAR_CACHE_TTL", 3600))
+POPULAR_STALE_TTL = int(os.getenv("POPULAR_STALE_TTL", 24 * 3600))
 
-@cached(cache)
-def get_cached_popular_perfumes(limit: int = 10):
+_history = TTLCache(maxsize=HISTORY_CACHE_MAXSIZE, ttl=HISTORY_CACHE_TTL)
+_popular = {}
+_loading = {}
+_lock = threading.Lock()
+_stats = {
+    "history": {"hits": 0, "misses": 0, "invalidated": 0},
+    "popular": {"hits": 0, "misses": 0, "stale": 0, "refreshes": 0},
+}
+
+def _count(namespace, key):
+    _stats[namespace][key] += 1
+
+def _single_flight(key, load, store):
     """
+    Concurrent misses for one key run load() once; the others wait for its
+    result. store(value) runs under the lock unless the key was invalidated
+    while loading, so an old read never overwrites a newer invalidation.
     """
-    print("CACHE MISS: Fetching popular perfumes from DB.")
-    conn = get_connection()
+    with _lock:
+        call = _loading.get(key)
+        leader = call is None
+        if leader:
+            call = _loading[key] = {"done": threading.Event(), "stale": False}
+    if not leader:
+        call["done"].wait()
+        if "error" in call:
+            raise call["error"]
+        return call["value"]
     try:
-        return fetch_popular_originals(conn, limit)
+        call["value"] = load()
+        with _lock:
+            if not call["stale"]:
+                store(call["value"])
+        return call["value"]
+    except Exception as e:
+        call["error"] = e
+        raise
     finally:
-        conn.close()
+        with _lock:
+            _loading.pop(key, None)
+        call["done"].set()
 
+def _fetch_popular(limit):
+    with pooled_connection() as conn:
+        return fetch_popular_originals(conn, limit)
 
-def get_cached_user_history(user_id: int):
+def _load_popular(limit):
+    def store(value):
+        _popular[limit] = (value, time.monotonic())
+    return _single_flight(("popular", limit), lambda: _fetch_popular(limit), store)
+
+def _refresh_popular(limit):
+    try:
+        _load_popular(limit)
+    except Exception as e:
+        print(f"❌ Не удалось обновить популярные ароматы: {e}")
+
+def get_cached_popular_perfumes(limit: int = 10):
     """
+    Fresh for POPULAR_CACHE_TTL seconds. Until POPULAR_STALE_TTL the old list
+    is still served while one background thread reloads it.
     """
-    cache_key = f"history_{user_id}"
-    
-    if cache_key in cache:
-        print(f"CACHE HIT: Returning history for user {user_id}.")
-        return cache[cache_key]
-    
-    print(f"CACHE MISS: Fetching history for user {user_id} from DB.")
-    conn = get_connection()
-    try:
-        history = fetch_user_history(conn, user_id)
-        cache.setdefault(cache_key, history)
-        cache.expire_time[cache_key] = cache.currtime + 300
-        return history
-    finally:
-        conn.close()
\ No newline at end of file
+    with _lock:
+        entry = _popular.get(limit)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age < POPULAR_CACHE_TTL:
+                _count("popular", "hits")
+                return value
+            if age < POPULAR_STALE_TTL:
+                _count("popular", "stale")
+                refresh = ("popular", limit) not in _loading
+                if refresh:
+                    _count("popular", "refreshes")
+                    threading.Thread(target=_refresh_popular, args=(limit,), daemon=True).start()
+                return value
+        _count("popular", "misses")
+    return _load_popular(limit)
+
+def get_cached_user_history(user_id: int):
+    """"""
+    with _lock:
+        if user_id in _history:
+            _count("history", "hits")
+            return _history[user_id]
+        _count("history", "misses")
+
+    def load():
+        with pooled_connection() as conn:
+            return fetch_user_history(conn, user_id)
+
+    def store(history):
+        _history[user_id] = history
+
+    return _single_flight(("history", user_id), load, store)
+
+def invalidate_user_history(user_id: int):
+    """"""
+    with _lock:
+        _history.pop(user_id, None)
+        call = _loading.get(("history", user_id))
+        if call is not None:
+            call["stale"] = True
+        _count("history", "invalidated")
+
+def _on_logs_written(rows):
+    """A new successful search changes the user's history, so it is reloaded on next view."""
+    for user_id in {row[0] for row in rows if row[3] == "success"}:
+        invalidate_user_history(user_id)
+
+def get_cache_stats():
+    """"""
+    with _lock:
+        return {
+            "history": {**_stats["history"], "size": len(_history)},
+            "popular": {**_stats["popular"], "size": len(_popular)},
+        }
+
+add_flush_listener(_on_logs_written)
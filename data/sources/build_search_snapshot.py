@@ -0,0 +1,52 @@
+# build_search_snapshot.py
+# Builds the in-memory search catalog once from the database and saves it, so
+# workers load it from disk instead of fetching and normalizing every row.
+# Run from the project root after importing new data:
+#     python data/sources/build_search_snapshot.py [--bump-version] [output path]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from database import (pooled_connection, fetch_all_originals, fetch_clones_for_search,
+                      fetch_catalog_version, bump_catalog_version, close_pool)
+from search import build_catalog, save_catalog_snapshot, SEARCH_SNAPSHOT_PATH
+
+def build_snapshot(path, bump_version=False):
+    """
+    Builds the snapshot for the current CatalogVersion and writes it to path.
+    With bump_version it is built for the next version and the version is
+    bumped only once the file is in place, so workers reloading on the bump
+    find the snapshot instead of all rebuilding from the database.
+    """
+    started = time.monotonic()
+    with pooled_connection() as conn:
+        version = fetch_catalog_version(conn)
+        if version is None and not bump_version:
+            raise RuntimeError("Таблица CatalogVersion не найдена, запустите бота один раз для её создания.")
+        if bump_version:
+            version = (version or 0) + 1
+        catalog = build_catalog(fetch_all_originals(conn), fetch_clones_for_search(conn), version)
+    save_catalog_snapshot(catalog, path)
+    print(f"✅ Снимок версии {version} записан в {path}: "
+          f"{len(catalog['originals']['id'])} оригиналов, {len(catalog['clones']['display_norm'])} копий, "
+          f"{time.monotonic() - started:.1f} с.")
+    if bump_version:
+        with pooled_connection() as conn:
+            bumped = bump_catalog_version(conn)
+        if bumped == version:
+            print(f"✅ Версия каталога повышена до {version}.")
+        else:
+            print(f"❌ Версия каталога изменилась во время сборки ({bumped} вместо {version}), "
+                  f"снимок не будет использован. Запустите сборку ещё раз.")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    bump = "--bump-version" in args
+    paths = [a for a in args if a != "--bump-version"]
+    try:
+        build_snapshot(paths[0] if paths else SEARCH_SNAPSHOT_PATH, bump_version=bump)
+    finally:
+        close_pool()
@@ -1,11 +1,43 @@
 import os
+import re
 import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
+import psycopg2.pool
+from psycopg2 import sql
 from dotenv import load_dotenv
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+DB_POOL_PING_AFTER = 60
+LOG_PARTITIONED = os.getenv("LOG_PARTITIONED", "1") == "1"
+LOG_PARTITION_MONTHS_AHEAD = int(os.getenv("LOG_PARTITION_MONTHS_AHEAD", 2))
+
+# pg_advisory_xact_lock key held while the schema and partitions are changed,
+# so processes starting (or checking partitions) at the same time take turns.
+SCHEMA_LOCK_ID = 5301
+
+# UserMessages indexes: (name, columns and predicate).
+MESSAGE_INDEXES = (
+    ("idx_usermessages_user_status_ts", "(user_id, status, timestamp DESC)"),
+    ("idx_usermessages_original_ts", "(original_id, timestamp) WHERE original_id IS NOT NULL"),
+)
+
+# Columns added to UserMessages after its first release.
+MESSAGE_ADDED_COLUMNS = (("original_id", "TEXT"), ("match_stage", "TEXT"), ("is_fuzzy", "BOOLEAN"))
+
+_pool = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+_checked_out = {}
 
 def get_connection(db_url=DATABASE_URL):
     if not db_url:
@@ -14,13 +46,150 @@ def get_connection(db_url=DATABASE_URL):
     conn.cursor_factory = psycopg2.extras.DictCursor
     return conn
 
-def init_db_if_not_exists(conn):
+def get_pool(db_url=DATABASE_URL):
+    """
+    Process-wide ThreadedConnectionPool, created on first use.
+    """
+    global _pool, _pool_slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if not db_url:
+                    raise ConnectionError("DATABASE_URL не указан! Проверьте настройки Render.")
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, db_url,
+                    cursor_factory=psycopg2.extras.DictCursor,
+                )
+                _pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+    return _pool
+
+def close_pool():
+    """Closes every pooled connection; the next checkout creates a new pool."""
+    global _pool, _pool_slots
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        _pool, _pool_slots = None, None
+        _last_used.clear()
+
+def _is_healthy(conn):
+    """
+    Dropped connections are detected on checkout. Connections idle for longer
+    than DB_POOL_PING_AFTER seconds are pinged, fresh ones are trusted.
+    """
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def get_pooled_connection():
+    """
+    Checks a healthy connection out of the pool, waiting up to DB_POOL_TIMEOUT
+    seconds when every connection is busy. Return it with put_pooled_connection.
+    """
+    pool = get_pool()
+    slots = _pool_slots
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError("Все соединения с БД заняты.")
+    try:
+        for _ in range(DB_POOL_MAX + 1):
+            conn = pool.getconn()
+            if _is_healthy(conn):
+                _checked_out[id(conn)] = (pool, slots)
+                return conn
+            _last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+        raise psycopg2.OperationalError("Не удалось получить рабочее соединение с БД.")
+    except Exception:
+        slots.release()
+        raise
+
+def put_pooled_connection(conn, discard=False):
+    """
+    Returns a connection to the pool. Uncommitted work is rolled back; broken
+    connections (or discard=True) are closed instead of being reused.
+    """
+    pool, slots = _checked_out.pop(id(conn), (None, None))
+    if pool is None:
+        conn.close()
+        return
+    try:
+        if not discard and not conn.closed:
+            conn.rollback()
+    except psycopg2.Error:
+        discard = True
+    discard = discard or bool(conn.closed)
+    if discard:
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+    try:
+        if not pool.closed:
+            pool.putconn(conn, close=discard)
+        else:
+            conn.close()
+    finally:
+        slots.release()
+
+@contextmanager
+def pooled_connection():
+    """
+    with pooled_connection() as conn: ...
+    Connection errors inside the block discard the connection instead of
+    returning it to the pool.
+    """
+    conn = get_pooled_connection()
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        put_pooled_connection(conn, discard=True)
+        raise
+    except BaseException:
+        put_pooled_connection(conn)
+        raise
+    else:
+        put_pooled_connection(conn)
+
+def init_db_if_not_exists(conn, create_partitions=True, commit=True):
     cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+    cursor.execute("SELECT to_regclass('usermessages') IS NULL")
+    messages_created = cursor.fetchone()[0]
+    if LOG_PARTITIONED:
+        # Monthly range partitions on timestamp, see ensure_message_partitions.
+        # The primary key of a partitioned table has to include the partition key.
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS UserMessages (
+                id BIGSERIAL, user_id BIGINT NOT NULL,
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL, message TEXT NOT NULL,
+                status TEXT NOT NULL, notes TEXT,
+                PRIMARY KEY (id, timestamp) ) PARTITION BY RANGE (timestamp)""")
+    else:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS UserMessages (
+                id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, 
+                timestamp TIMESTAMP WITH TIME ZONE NOT NULL, message TEXT NOT NULL,
+                status TEXT NOT NULL, notes TEXT )""")
+    # ALTER TABLE takes an ACCESS EXCLUSIVE lock even when the column exists,
+    # which would queue every log insert behind each worker's startup.
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS UserMessages (
-            id SERIAL PRIMARY KEY, user_id BIGINT NOT NULL, 
-            timestamp TIMESTAMP WITH TIME ZONE NOT NULL, message TEXT NOT NULL,
-            status TEXT NOT NULL, notes TEXT )""")
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'usermessages'""")
+    existing = {row[0] for row in cursor.fetchall()}
+    for column, column_type in MESSAGE_ADDED_COLUMNS:
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE UserMessages ADD COLUMN IF NOT EXISTS {column} {column_type}")
+    if messages_created:
+        # The table is empty, so this is instant. An existing table gets its
+        # indexes from migrate_search_log.py, built without blocking inserts.
+        create_message_indexes(conn)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS OriginalPerfume (
             id TEXT PRIMARY KEY, brand TEXT, name TEXT,
@@ -30,64 +199,307 @@ def init_db_if_not_exists(conn):
             id TEXT PRIMARY KEY, original_id TEXT, brand TEXT, name TEXT,
             price_eur REAL, url TEXT, notes TEXT, saved_amount REAL,
             FOREIGN KEY(original_id) REFERENCES OriginalPerfume(id) )""")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ProcessedUpdates (
+            update_id BIGINT PRIMARY KEY,
+            received_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now() )""")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS CatalogVersion (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version BIGINT NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now() )""")
+    cursor.execute("INSERT INTO CatalogVersion (id, version) VALUES (1, 1) ON CONFLICT DO NOTHING")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS UserState (
+            namespace TEXT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            PRIMARY KEY (namespace, chat_id) )""")
+    if not commit:
+        return
+    conn.commit()
+    if create_partitions and is_user_messages_partitioned(conn):
+        ensure_message_partitions(conn)
+
+def create_message_indexes(conn, concurrently=False):
+    """
+    Creates the MESSAGE_INDEXES that do not exist yet. concurrently=True is
+    for a plain (not partitioned) UserMessages on a connection in autocommit
+    mode: inserts keep going during the build, and an invalid index left by an
+    interrupted build is dropped and rebuilt.
+    """
+    cur = conn.cursor()
+    for name, definition in MESSAGE_INDEXES:
+        if concurrently:
+            cur.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (name,))
+            row = cur.fetchone()
+            if row and not row[0]:
+                cur.execute(sql.SQL("DROP INDEX CONCURRENTLY {}").format(sql.Identifier(name)))
+        cur.execute(
+            sql.SQL("CREATE INDEX {}IF NOT EXISTS {} ON UserMessages {}").format(
+                sql.SQL("CONCURRENTLY " if concurrently else ""), sql.Identifier(name), sql.SQL(definition))
+        )
+
+def is_user_messages_partitioned(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT 1 FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = 'usermessages'""")
+    partitioned = cur.fetchone() is not None
+    conn.commit()
+    return partitioned
+
+def _month_start(moment, months=0):
+    """First instant (UTC) of the month `months` after the one containing `moment`."""
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+def _parse_bound(text):
+    return None if text in ("MINVALUE", "MAXVALUE") else datetime.fromisoformat(text.strip("'"))
+
+def _fetch_message_partitions(cur):
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'usermessages'""")
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = re.match(r"FOR VALUES FROM \((.+)\) TO \((.+)\)", bound)
+        if match:
+            partitions.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+        else:
+            partitions.append((name, None, None))
+    epoch = datetime.min.replace(tzinfo=timezone.utc)
+    return sorted(partitions, key=lambda p: p[1] or epoch)
+
+def list_message_partitions(conn):
+    """
+    (name, lower, upper) of every UserMessages partition, ordered by lower
+    bound. Bounds are aware datetimes, None for MINVALUE / MAXVALUE; the
+    default partition is reported as (name, None, None).
+    """
+    partitions = _fetch_message_partitions(conn.cursor())
+    conn.commit()
+    return partitions
+
+def ensure_message_partitions(conn, months_ahead=LOG_PARTITION_MONTHS_AHEAD, now=None):
+    """
+    Creates the default partition and monthly partitions from the current
+    month to `months_ahead` months later, skipping ranges an existing partition
+    already covers. Rows that landed in the default partition for a new month
+    are moved into it. Returns the created names.
+
+    Everything runs in one transaction under the SCHEMA_LOCK_ID advisory lock,
+    so concurrent callers never create the same partition twice. While rows are
+    moved, the default partition is locked against inserts, so ATTACH never
+    finds a row for the new month that arrived after the move.
+    """
+    now = now or datetime.now(timezone.utc)
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+    partitions = _fetch_message_partitions(cur)
+    if not any(name == "usermessages_default" for name, _, _ in partitions):
+        cur.execute("CREATE TABLE usermessages_default PARTITION OF UserMessages DEFAULT")
+
+    ranges = [(lo, hi) for name, lo, hi in partitions if name != "usermessages_default"]
+    created = []
+    for offset in range(months_ahead + 1):
+        lo, hi = _month_start(now, offset), _month_start(now, offset + 1)
+        if any((a is None or a < hi) and (b is None or lo < b) for a, b in ranges):
+            continue
+        if not created:
+            cur.execute("LOCK TABLE usermessages_default IN SHARE ROW EXCLUSIVE MODE")
+        name = f"usermessages_p{lo:%Y_%m}"
+        partition = sql.Identifier(name)
+        cur.execute(sql.SQL("CREATE TABLE {} (LIKE UserMessages INCLUDING DEFAULTS INCLUDING CONSTRAINTS)").format(partition))
+        cur.execute(
+            sql.SQL("""
+                WITH moved AS (
+                    DELETE FROM usermessages_default
+                    WHERE timestamp >= %s AND timestamp < %s
+                    RETURNING *
+                )
+                INSERT INTO {} SELECT * FROM moved""").format(partition),
+            (lo, hi),
+        )
+        cur.execute(
+            sql.SQL("ALTER TABLE UserMessages ATTACH PARTITION {} FOR VALUES FROM (%s) TO (%s)").format(partition),
+            (lo, hi),
+        )
+        ranges.append((lo, hi))
+        created.append(name)
+    conn.commit()
+    return created
+
+def drop_message_partition(conn, name):
+    """Detaches and drops one UserMessages partition."""
+    cur = conn.cursor()
+    cur.execute(sql.SQL("ALTER TABLE UserMessages DETACH PARTITION {}").format(sql.Identifier(name)))
+    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
     conn.commit()
 
 def _convert_dict_row(row):
     return dict(row) if row else None
 
-def fetch_all_originals(conn):
+def mark_update_seen(conn, update_id):
+    """True when this update_id was not recorded yet (and is recorded now)."""
     cur = conn.cursor()
-    cur.execute("SELECT id, brand, name FROM OriginalPerfume")
-    return [_convert_dict_row(row) for row in cur.fetchall()]
+    cur.execute(
+        "INSERT INTO ProcessedUpdates (update_id) VALUES (%s) ON CONFLICT DO NOTHING",
+        (update_id,),
+    )
+    conn.commit()
+    return cur.rowcount == 1
 
-def fetch_clones_for_search(conn):
+def forget_update(conn, update_id):
     cur = conn.cursor()
-    cur.execute("SELECT brand, name, original_id FROM CopyPerfume")
-    return [_convert_dict_row(row) for row in cur.fetchall()]
+    cur.execute("DELETE FROM ProcessedUpdates WHERE update_id = %s", (update_id,))
+    conn.commit()
 
-def fetch_original_by_id(conn, original_id):
+def purge_processed_updates(conn, max_age_seconds):
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, brand, name, price_eur, url FROM OriginalPerfume WHERE id = %s",
-        (original_id,),
+        "DELETE FROM ProcessedUpdates WHERE received_at < now() - make_interval(secs => %s)",
+        (max_age_seconds,),
     )
-    return _convert_dict_row(cur.fetchone())
+    conn.commit()
+    return cur.rowcount
 
-def get_copies_by_original_id(conn, original_id):
+def fetch_user_state(conn, namespace, chat_id):
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, original_id, brand, name, price_eur, url, notes, saved_amount FROM CopyPerfume WHERE original_id = %s",
-        (original_id,),
+        "SELECT value FROM UserState WHERE namespace = %s AND chat_id = %s AND expires_at > now()",
+        (namespace, chat_id),
     )
-    return [_convert_dict_row(row) for row in cur.fetchall()]
+    row = cur.fetchone()
+    conn.commit()
+    return row[0] if row else None
 
-def log_message(conn, user_id, message, status, notes=""):
-    cursor = conn.cursor()
-    current_time = time.time()
-    cursor.execute(
-        "INSERT INTO UserMessages (user_id, timestamp, message, status, notes) VALUES (%s, to_timestamp(%s), %s, %s, %s)",
-        (user_id, current_time, message, status, notes),
+def save_user_state(conn, namespace, chat_id, value, ttl_seconds):
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO UserState (namespace, chat_id, value, expires_at)
+        VALUES (%s, %s, %s, now() + make_interval(secs => %s))
+        ON CONFLICT (namespace, chat_id)
+        DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+        """,
+        (namespace, chat_id, value, ttl_seconds),
     )
     conn.commit()
 
-def fetch_user_history(conn, user_id: int, limit: int = 5):
+def delete_user_state(conn, namespace, chat_id):
     cur = conn.cursor()
-    query = """
-        SELECT DISTINCT ON (notes) notes
-        FROM UserMessages
-        WHERE user_id = %s AND status = 'success' AND notes LIKE 'Found: %%'
-        ORDER BY notes, timestamp DESC
-        LIMIT %s
+    cur.execute(
+        "DELETE FROM UserState WHERE namespace = %s AND chat_id = %s RETURNING value, expires_at > now()",
+        (namespace, chat_id),
+    )
+    row = cur.fetchone()
+    conn.commit()
+    return row[0] if row and row[1] else None
+
+def purge_user_states(conn):
+    cur = conn.cursor()
+    cur.execute("DELETE FROM UserState WHERE expires_at <= now()")
+    conn.commit()
+    return cur.rowcount
+
+def count_user_states(conn, namespace):
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM UserState WHERE namespace = %s AND expires_at > now()", (namespace,))
+    count = cur.fetchone()[0]
+    conn.commit()
+    return count
+
+def fetch_catalog_version(conn):
+    """None when the CatalogVersion table is missing or empty."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT version FROM CatalogVersion WHERE id = 1")
+        row = cur.fetchone()
+    except psycopg2.errors.UndefinedTable:
+        conn.rollback()
+        return None
+    conn.commit()
+    return row[0] if row else None
+
+def bump_catalog_version(conn):
+    """Called after an import changes the catalog; running workers reload on their next check."""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        INSERT INTO CatalogVersion (id, version) VALUES (1, 1)
+        ON CONFLICT (id) DO UPDATE SET version = CatalogVersion.version + 1, updated_at = now()
+        RETURNING version
+        """
+    )
+    version = cur.fetchone()[0]
+    conn.commit()
+    return version
+
+def fetch_all_originals(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT id, brand, name FROM OriginalPerfume")
+    return [_convert_dict_row(row) for row in cur.fetchall()]
+
+def fetch_clones_for_search(conn):
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, original_id, brand, name, price_eur, url, notes, saved_amount FROM CopyPerfume"
+    )
+    return [_convert_dict_row(row) for row in cur.fetchall()]
+
+LOG_COLUMNS = "user_id, timestamp, message, status, notes, original_id, match_stage, is_fuzzy"
+
+def insert_log_rows(conn, rows):
     """
-    cur.execute(query, (user_id, limit))
-    history = []
-    for row in cur.fetchall():
+    Bulk insert of (user_id, unix_ts, message, status, notes, original_id,
+    match_stage, is_fuzzy) tuples in a single statement and commit.
+    Retried once on CheckViolation: that is a partition attached by
+    ensure_message_partitions while the insert waited to write into the
+    default partition, and a new statement routes the rows to it.
+    """
+    cursor = conn.cursor()
+    for attempt in range(2):
         try:
-            perfume = row['notes'].split('Found: ')[1].split(' | NOTE:')[0]
-            history.append(perfume)
-        except IndexError:
-            continue
-    return history
+            psycopg2.extras.execute_values(
+                cursor,
+                f"INSERT INTO UserMessages ({LOG_COLUMNS}) VALUES %s",
+                rows,
+                template="(%s, to_timestamp(%s), %s, %s, %s, %s, %s, %s)",
+                page_size=len(rows) or 1,
+            )
+            conn.commit()
+            return
+        except psycopg2.errors.CheckViolation:
+            conn.rollback()
+            if attempt:
+                raise
+
+# The user's most recently found originals, newest first. Reads
+# idx_usermessages_user_status_ts instead of scanning and parsing notes.
+USER_HISTORY_QUERY = """
+    SELECT o.brand, o.name
+    FROM (
+        SELECT original_id, MAX(timestamp) AS last_found
+        FROM UserMessages
+        WHERE user_id = {user} AND status = 'success' AND original_id IS NOT NULL
+        GROUP BY original_id
+        ORDER BY last_found DESC
+        LIMIT {limit}
+    ) h
+    JOIN OriginalPerfume o ON o.id = h.original_id
+    ORDER BY h.last_found DESC
+"""
+
+def fetch_user_history(conn, user_id: int, limit: int = 5):
+    cur = conn.cursor()
+    cur.execute(USER_HISTORY_QUERY.format(user="%s", limit="%s"), (user_id, limit))
+    return [f"{row['brand']} {row['name']}" for row in cur.fetchall()]
 
 
 def fetch_popular_originals(conn, limit: int = 10):
@@ -102,9 +514,3 @@ def fetch_popular_originals(conn, limit: int = 10):
     """
     cur.execute(query, (limit,))
     return cur.fetchall()
-
-
-def fetch_random_original(conn):
-    cur = conn.cursor()
-    cur.execute("SELECT id, brand, name FROM OriginalPerfume ORDER BY RANDOM() LIMIT 1")
-    return _convert_dict_row(cur.fetchone())
\ No newline at end of file
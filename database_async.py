@@ -0,0 +1,45 @@
+import asyncpg
+from database import DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, USER_HISTORY_QUERY
+
+_pool = None
+
+async def get_async_pool(db_url=DATABASE_URL):
+    """
+    asyncpg pool for the asyncio entry point, created on first use.
+    """
+    global _pool
+    if _pool is None:
+        if not db_url:
+            raise ConnectionError("DATABASE_URL не указан! Проверьте настройки Render.")
+        _pool = await asyncpg.create_pool(db_url, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX)
+    return _pool
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+def _convert_record(record):
+    return dict(record) if record else None
+
+async def fetch_user_history(user_id: int, limit: int = 5):
+    pool = await get_async_pool()
+    rows = await pool.fetch(USER_HISTORY_QUERY.format(user="$1", limit="$2"), user_id, limit)
+    return [f"{row['brand']} {row['name']}" for row in rows]
+
+async def fetch_popular_originals(limit: int = 10):
+    pool = await get_async_pool()
+    rows = await pool.fetch(
+        """
+        SELECT o.brand, o.name, COUNT(c.id) AS clone_count
+        FROM OriginalPerfume o
+        JOIN CopyPerfume c ON o.id = c.original_id
+        GROUP BY o.id
+        ORDER BY clone_count DESC
+        LIMIT $1
+        """,
+        limit,
+    )
+    return [_convert_record(row) for row in rows]
+
@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import database
+from database import pooled_connection
+
+UPDATE_DEDUP_BACKEND = os.getenv("UPDATE_DEDUP_BACKEND", "memory")
+UPDATE_DEDUP_TTL = int(os.getenv("UPDATE_DEDUP_TTL", 3600))
+UPDATE_DEDUP_MAXSIZE = int(os.getenv("UPDATE_DEDUP_MAXSIZE", 100000))
+PURGE_INTERVAL = 300
+
+_seen = OrderedDict()
+_lock = threading.Lock()
+_stats = {"unique": 0, "duplicates": 0}
+_last_purge = 0.0
+
+def _expire(now):
+    while _seen:
+        update_id, seen_at = next(iter(_seen.items()))
+        if now - seen_at < UPDATE_DEDUP_TTL and len(_seen) <= UPDATE_DEDUP_MAXSIZE:
+            break
+        _seen.popitem(last=False)
+
+def _seen_locally(update_id):
+    now = time.monotonic()
+    with _lock:
+        _expire(now)
+        if update_id in _seen:
+            return True
+        _seen[update_id] = now
+        return False
+
+def _seen_shared(update_id):
+    """
+    Multi-worker check through the ProcessedUpdates table. A DB failure lets the
+    update through: handling it twice is better than dropping it.
+    """
+    global _last_purge
+    try:
+        with pooled_connection() as conn:
+            first_time = database.mark_update_seen(conn, update_id)
+            if time.monotonic() - _last_purge > PURGE_INTERVAL:
+                _last_purge = time.monotonic()
+                database.purge_processed_updates(conn, UPDATE_DEDUP_TTL)
+        return not first_time
+    except Exception as e:
+        print(f"❌ Проверка дубликата update {update_id} не удалась: {e}")
+        return False
+
+def is_duplicate_update(update_id):
+    """
+    True when this update_id was already accepted within UPDATE_DEDUP_TTL
+    seconds. The in-process window answers redeliveries to the same worker
+    without I/O; UPDATE_DEDUP_BACKEND=postgres also catches those that land on
+    another worker.
+    """
+    duplicate = _seen_locally(update_id)
+    if not duplicate and UPDATE_DEDUP_BACKEND == "postgres":
+        duplicate = _seen_shared(update_id)
+    with _lock:
+        _stats["duplicates" if duplicate else "unique"] += 1
+    return duplicate
+
+def forget_update(update_id):
+    """
+    Un-marks an update that was accepted by is_duplicate_update but could not be
+    queued, so Telegram's retry of it is processed.
+    """
+    with _lock:
+        _seen.pop(update_id, None)
+    if UPDATE_DEDUP_BACKEND == "postgres":
+        try:
+            with pooled_connection() as conn:
+                database.forget_update(conn, update_id)
+        except Exception as e:
+            print(f"❌ Не удалось снять отметку с update {update_id}: {e}")
+
+def get_dedup_stats():
+    """"""
+    with _lock:
+        return {**_stats, "window": len(_seen), "backend": UPDATE_DEDUP_BACKEND}
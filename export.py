@@ -0,0 +1,149 @@
+import io
+import os
+import csv
+import sys
+import json
+import argparse
+from dotenv import load_dotenv
+from database import pooled_connection, close_pool
+
+load_dotenv()
+
+EXPORT_BATCH = int(os.getenv("EXPORT_BATCH", 5000))
+
+# Each export walks its rows in key order, so a run can resume after the last
+# key it wrote.
+EXPORTS = {
+    "messages": {
+        "query": """
+            SELECT id, user_id, timestamp, message, status, notes,
+                   original_id, match_stage, is_fuzzy
+            FROM UserMessages
+            WHERE id > %(after)s {time_filter}
+            ORDER BY id
+        """,
+        "key": "id",
+        "start": 0,
+        "time_filter": True,
+    },
+    "catalog": {
+        "query": """
+            SELECT c.id AS copy_id, c.brand AS copy_brand, c.name AS copy_name,
+                   c.price_eur AS copy_price_eur, c.url AS copy_url, c.notes AS copy_notes,
+                   c.saved_amount, o.id AS original_id, o.brand AS original_brand,
+                   o.name AS original_name, o.price_eur AS original_price_eur, o.url AS original_url
+            FROM CopyPerfume c
+            JOIN OriginalPerfume o ON o.id = c.original_id
+            WHERE c.id > %(after)s
+            ORDER BY c.id
+        """,
+        "key": "copy_id",
+        "start": "",
+        "time_filter": False,
+    },
+}
+
+def _state_path(out_path):
+    return f"{out_path}.state"
+
+def _load_state(out_path):
+    if not os.path.exists(_state_path(out_path)):
+        return None
+    with open(_state_path(out_path), encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_state(out_path, state):
+    tmp_path = f"{_state_path(out_path)}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, _state_path(out_path))
+
+def _encode_batch(rows, columns, fmt, header):
+    buf = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(buf)
+        if header:
+            writer.writerow(columns)
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            buf.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str))
+            buf.write("\n")
+    return buf.getvalue().encode("utf-8")
+
+def export(kind, out_path, fmt="csv", since=None, until=None, resume=False, batch_size=EXPORT_BATCH):
+    """
+    Streams an export to out_path through a named (server-side) cursor,
+    batch_size rows at a time, so memory use does not depend on table size.
+    After every batch the last written key and file size go to
+    <out_path>.state; with resume=True the file is cut back to that size and
+    the export continues after that key (also picking up rows added since).
+    resume=True without a state file, or whose output file is missing or
+    shorter than the saved size, starts a new export.
+    """
+    spec = EXPORTS[kind]
+    if (since or until) and not spec["time_filter"]:
+        raise ValueError(f"Экспорт {kind} не поддерживает фильтр по времени.")
+
+    state = {"kind": kind, "format": fmt, "since": since, "until": until,
+             "after": spec["start"], "offset": 0, "rows": 0}
+    saved = _load_state(out_path) if resume else None
+    if saved is not None and (not os.path.exists(out_path) or os.path.getsize(out_path) < saved["offset"]):
+        print(f"Файл {out_path} отсутствует или короче сохранённого состояния, экспорт начинается заново.")
+        saved = None
+    if saved is not None:
+        if any(saved[field] != state[field] for field in ("kind", "format", "since", "until")):
+            raise ValueError("Параметры не совпадают с прерванным экспортом, продолжить нельзя.")
+        state = saved
+
+    time_filter = ""
+    if since:
+        time_filter += " AND timestamp >= %(since)s"
+    if until:
+        time_filter += " AND timestamp < %(until)s"
+    query = spec["query"].format(time_filter=time_filter)
+    params = {"after": state["after"], "since": since, "until": until}
+
+    with open(out_path, "r+b" if saved is not None else "wb") as out, pooled_connection() as conn:
+        out.truncate(state["offset"])
+        out.seek(state["offset"])
+        cur = conn.cursor(name=f"export_{kind}")
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        columns = None
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = columns or [column[0] for column in cur.description]
+            out.write(_encode_batch(rows, columns, fmt, header=state["offset"] == 0))
+            out.flush()
+            state["after"] = rows[-1][columns.index(spec["key"])]
+            state["offset"] = out.tell()
+            state["rows"] += len(rows)
+            _save_state(out_path, state)
+            print(f"  {kind}: {state['rows']} строк, последний ключ {state['after']}")
+        cur.close()
+        conn.commit()
+    _save_state(out_path, state)
+    return state["rows"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Потоковый экспорт логов и каталога.")
+    parser.add_argument("kind", choices=sorted(EXPORTS))
+    parser.add_argument("out", help="файл результата")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--since", help="начало периода включительно, например 2024-01-01")
+    parser.add_argument("--until", help="конец периода, не включительно")
+    parser.add_argument("--resume", action="store_true", help="продолжить с места остановки")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH)
+    args = parser.parse_args(argv)
+    try:
+        rows = export(args.kind, args.out, args.format, args.since, args.until,
+                      args.resume, args.batch_size)
+        print(f"✅ Экспорт {args.kind} завершён: {rows} строк в {args.out}")
+    finally:
+        close_pool()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,17 +1,136 @@
+import os
+import time
+import heapq
+import uuid
+import itertools
 import threading
 from i18n import get_message
+from state_store import create_state_store
 
-def schedule_followup_once(bot, chat_id, ts, last_user_ts, followup_sent, lang):
-    if followup_sent.get(chat_id):
+FOLLOWUP_DELAY = float(os.getenv("FOLLOWUP_DELAY", 30))
+FOLLOWUP_SENT_TTL = int(os.getenv("FOLLOWUP_SENT_TTL", 7 * 24 * 3600))
+FOLLOWUP_ACTIVITY_TTL = int(FOLLOWUP_DELAY) + 600
+
+_sender = None
+_heap = []
+# chat_id -> (due, seq, lang, token) for the follow-ups this process will send.
+_pending = {}
+# Shared by all workers: the token of the latest follow-up scheduled for a chat,
+# removed on any later action, and the chats that already got one. The sender
+# checks both, so a follow-up is dropped when the user moved on through another
+# worker, and each chat gets at most one per FOLLOWUP_SENT_TTL.
+_activity = create_state_store("followup", FOLLOWUP_ACTIVITY_TTL)
+_sent = create_state_store("followup_sent", FOLLOWUP_SENT_TTL)
+_seq = itertools.count()
+_cond = threading.Condition()
+_thread = None
+_stats = {"scheduled": 0, "coalesced": 0, "cancelled": 0, "superseded": 0, "sent": 0, "failed": 0}
+
+def set_followup_sender(send):
+    """send(chat_id, text) delivers the follow-up, e.g. bot.send_message."""
+    global _sender
+    _sender = send
+
+def _compact():
+    """Drops heap entries of cancelled or rescheduled follow-ups."""
+    global _heap
+    _heap = [entry for entry in _heap if _pending.get(entry[2], (None, None))[1] == entry[1]]
+    heapq.heapify(_heap)
+
+def _pop_due(now):
+    due = []
+    while _heap and _heap[0][0] <= now:
+        _, seq, chat_id = heapq.heappop(_heap)
+        entry = _pending.get(chat_id)
+        if entry is None or entry[1] != seq:
+            continue
+        del _pending[chat_id]
+        due.append((chat_id, entry[2], entry[3]))
+    return due
+
+def _run():
+    while True:
+        with _cond:
+            now = time.monotonic()
+            due = _pop_due(now)
+            if not due:
+                _cond.wait(timeout=_heap[0][0] - now if _heap else None)
+                continue
+        for chat_id, lang, token in due:
+            try:
+                if _activity.get(chat_id) != token or _sent.get(chat_id) is not None:
+                    outcome = "superseded"
+                else:
+                    _sender(chat_id, get_message("followup_text", lang))
+                    _sent[chat_id] = "1"
+                    outcome = "sent"
+            except Exception as e:
+                print(f"❌ Не удалось отправить follow-up в чат {chat_id}: {e}")
+                outcome = "failed"
+            with _cond:
+                _stats[outcome] += 1
+
+def _ensure_thread():
+    global _thread
+    if _thread is None or not _thread.is_alive():
+        _thread = threading.Thread(target=_run, name="followup-scheduler", daemon=True)
+        _thread.start()
+
+def _push(chat_id, lang, token, delay):
+    with _cond:
+        seq = next(_seq)
+        if chat_id in _pending:
+            _stats["coalesced"] += 1
+        else:
+            _stats["scheduled"] += 1
+        _pending[chat_id] = (time.monotonic() + delay, seq, lang, token)
+        heapq.heappush(_heap, (_pending[chat_id][0], seq, chat_id))
+        if len(_heap) > 2 * len(_pending) + 64:
+            _compact()
+        _ensure_thread()
+        _cond.notify()
+
+def _drop(chat_id):
+    with _cond:
+        if _pending.pop(chat_id, None) is not None:
+            _stats["cancelled"] += 1
+
+def schedule_followup(chat_id, lang, delay=FOLLOWUP_DELAY):
+    """
+    Sends the follow-up to chat_id after delay seconds, at most once per
+    FOLLOWUP_SENT_TTL. Scheduling a chat again moves its single pending
+    follow-up instead of adding another one.
+    """
+    if _sender is None:
+        raise RuntimeError("set_followup_sender() must be called before schedule_followup().")
+    if _sent.get(chat_id) is not None:
         return
+    token = uuid.uuid4().hex
+    _activity[chat_id] = token
+    _push(chat_id, lang, token, delay)
 
-    followup_text = get_message("followup_text", lang)
+def cancel_followup(chat_id):
+    """Called on every new user action: the follow-up is only for idle chats."""
+    _activity.pop(chat_id, None)
+    _drop(chat_id)
+
+async def aschedule_followup(chat_id, lang, delay=FOLLOWUP_DELAY):
+    """schedule_followup for the asyncio entry point."""
+    if _sender is None:
+        raise RuntimeError("set_followup_sender() must be called before schedule_followup().")
+    if await _sent.aget(chat_id) is not None:
+        return
+    token = uuid.uuid4().hex
+    await _activity.aset(chat_id, token)
+    _push(chat_id, lang, token, delay)
 
-    def _send():
-        if last_user_ts.get(chat_id, 0) == ts and not followup_sent.get(chat_id):
-            bot.send_message(chat_id, followup_text)
-            followup_sent[chat_id] = True
+async def acancel_followup(chat_id):
+    """cancel_followup for the asyncio entry point."""
+    await _activity.apop(chat_id, None)
+    _drop(chat_id)
 
-    t = threading.Timer(30.0, _send)
-    t.daemon = True
-    t.start()
\ No newline at end of file
+def get_followup_stats():
+    """"""
+    with _cond:
+        stats = {**_stats, "pending": len(_pending), "heap": len(_heap)}
+    return {**stats, "sent_window": len(_sent)}
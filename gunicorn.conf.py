@@ -0,0 +1,35 @@
+import gc
+import os
+
+# The app is imported and initialized once in the master, then forked: workers
+# start instantly and share the catalog pages instead of each loading a copy.
+wsgi_app = "web:create_app()"
+preload_app = True
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+
+def _serves_web(app):
+    # Gunicorn reads this file for every command run from the repo, including
+    # `gunicorn web_async:app`; the worker hooks are for the Flask app only.
+    return (app.app_uri or "").split(":")[0] == "web"
+
+def when_ready(server):
+    from database import close_pool
+    # Connections opened while preloading must not be shared by the workers.
+    close_pool()
+    # Objects created so far are never collected; without this the collector
+    # writes to them and un-shares their pages in every worker.
+    gc.freeze()
+
+def post_fork(server, worker):
+    if not _serves_web(server.app):
+        return
+    import web
+    web.start_worker()
+
+def post_worker_init(worker):
+    if not _serves_web(worker.app):
+        return
+    import web
+    # Gunicorn resets worker signal handlers after post_fork.
+    web.install_signal_handlers()
@@ -0,0 +1,139 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from database import pooled_connection, insert_log_rows
+from database import is_user_messages_partitioned, ensure_message_partitions
+
+LOG_QUEUE_MAXSIZE = int(os.getenv("LOG_QUEUE_MAXSIZE", 10000))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 200))
+LOG_FLUSH_INTERVAL = int(os.getenv("LOG_FLUSH_MS", 500)) / 1000
+PARTITION_CHECK_INTERVAL = int(os.getenv("PARTITION_CHECK_INTERVAL", 3600))
+
+_STOP = object()
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_MAXSIZE)
+_stats = {"written": 0, "dropped": 0, "failed": 0, "batches": 0}
+_stats_lock = threading.Lock()
+_worker = None
+_worker_lock = threading.Lock()
+_flush_listeners = []
+_partitioner = None
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+def _flush(batch):
+    try:
+        with pooled_connection() as conn:
+            insert_log_rows(conn, batch)
+    except Exception as e:
+        print(f"❌ Не удалось записать {len(batch)} строк лога: {e}")
+        _count("failed", len(batch))
+        return
+    _count("written", len(batch))
+    _count("batches")
+    for listener in _flush_listeners:
+        try:
+            listener(batch)
+        except Exception as e:
+            print(f"❌ Ошибка обработчика записи лога: {e}")
+
+def _run():
+    batch, deadline = [], None
+    while True:
+        timeout = LOG_FLUSH_INTERVAL if not batch else max(0.0, deadline - time.monotonic())
+        try:
+            item = _queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+
+        if item is _STOP:
+            if batch:
+                _flush(batch)
+            return
+        if item is not None:
+            if not batch:
+                deadline = time.monotonic() + LOG_FLUSH_INTERVAL
+            batch.append(item)
+
+        if batch and (len(batch) >= LOG_BATCH_SIZE or time.monotonic() >= deadline):
+            _flush(batch)
+            batch = []
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="log-writer", daemon=True)
+            _worker.start()
+
+def add_flush_listener(listener):
+    """listener(rows) is called from the writer thread after rows are committed."""
+    _flush_listeners.append(listener)
+
+def enqueue_log(user_id, message, status, notes="", original_id=None, match_stage=None, is_fuzzy=None):
+    """
+    Queues a UserMessages row for the background writer; never waits on the DB.
+    The row keeps the time it was queued, not the time it was flushed.
+    """
+    _ensure_worker()
+    try:
+        _queue.put_nowait((user_id, time.time(), message, status, notes, original_id, match_stage, is_fuzzy))
+    except queue.Full:
+        _count("dropped")
+
+def get_log_queue_stats():
+    """"""
+    with _stats_lock:
+        return {"depth": _queue.qsize(), **_stats}
+
+def flush_logs(timeout=5.0):
+    """
+    Writes everything still queued and stops the worker. Called at exit; a
+    later enqueue_log starts a new worker.
+    """
+    global _worker
+    with _worker_lock:
+        worker, _worker = _worker, None
+    if worker is None or not worker.is_alive():
+        return
+    try:
+        _queue.put(_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    worker.join(timeout)
+
+def _ensure_partitions():
+    with pooled_connection() as conn:
+        if is_user_messages_partitioned(conn):
+            created = ensure_message_partitions(conn)
+            if created:
+                print(f"✅ Созданы секции UserMessages: {', '.join(created)}")
+
+def _maintain_partitions(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            _ensure_partitions()
+        except Exception as e:
+            print(f"❌ Не удалось создать секции UserMessages: {e}")
+
+def start_partition_maintainer(interval=PARTITION_CHECK_INTERVAL):
+    """
+    Creates the coming months' UserMessages partitions every `interval`
+    seconds, so a long-running worker never writes into the default
+    partition. Runs in each worker; does nothing when interval is 0.
+    """
+    global _partitioner
+    if interval <= 0 or (_partitioner is not None and _partitioner.is_alive()):
+        return
+    _partitioner = threading.Thread(target=_maintain_partitions, args=(interval,),
+                                    name="partition-maintainer", daemon=True)
+    _partitioner.start()
+
+atexit.register(flush_logs)
@@ -0,0 +1,64 @@
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from database import (pooled_connection, close_pool, init_db_if_not_exists,
+                      is_user_messages_partitioned, ensure_message_partitions, _month_start)
+
+load_dotenv()
+
+# Objects of the plain table whose names the partitioned table reuses. Its
+# primary key (id) is dropped: ATTACH gives it the partitioned (id, timestamp)
+# key, and a table cannot have both.
+LEGACY_RENAMES = (
+    "ALTER TABLE UserMessages RENAME TO usermessages_legacy",
+    "ALTER TABLE usermessages_legacy DROP CONSTRAINT usermessages_pkey",
+    "ALTER SEQUENCE usermessages_id_seq RENAME TO usermessages_legacy_id_seq",
+    "ALTER INDEX IF EXISTS idx_usermessages_user_status_ts RENAME TO idx_usermessages_legacy_user_status_ts",
+    "ALTER INDEX IF EXISTS idx_usermessages_original_ts RENAME TO idx_usermessages_legacy_original_ts",
+)
+
+def partition_user_messages():
+    """
+    Turns an existing plain UserMessages table into the partitioned layout
+    without copying rows: the old table becomes one partition covering
+    everything up to the end of the current month, and new months get their
+    own partitions. Ids continue from the old sequence, so the rollup
+    watermark stays valid.
+
+    The old id column is widened to BIGINT (a one-time table rewrite) and the
+    table is locked while that runs, so run it in a quiet window. Everything
+    after the column update is one transaction: a failure leaves the plain
+    table as it was.
+    """
+    with pooled_connection() as conn:
+        if is_user_messages_partitioned(conn):
+            print("UserMessages уже секционирована.")
+            return
+        # Brings the plain table to the current columns, which ATTACH requires.
+        init_db_if_not_exists(conn, create_partitions=False)
+        cur = conn.cursor()
+        cur.execute("LOCK TABLE UserMessages IN ACCESS EXCLUSIVE MODE")
+        cur.execute("SELECT COALESCE(MAX(id), 0), MAX(timestamp) FROM UserMessages")
+        max_id, max_ts = cur.fetchone()
+        for statement in LEGACY_RENAMES:
+            cur.execute(statement)
+        cur.execute("ALTER TABLE usermessages_legacy ALTER COLUMN id DROP DEFAULT")
+        cur.execute("ALTER TABLE usermessages_legacy ALTER COLUMN id TYPE BIGINT")
+
+        init_db_if_not_exists(conn, create_partitions=False, commit=False)
+
+        now = datetime.now(timezone.utc)
+        upper = _month_start(max(max_ts or now, now), 1)
+        cur.execute("SELECT setval('usermessages_id_seq', GREATEST(%s, 1), %s > 0)", (max_id, max_id))
+        cur.execute(
+            "ALTER TABLE UserMessages ATTACH PARTITION usermessages_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+            (upper,),
+        )
+        conn.commit()
+        ensure_message_partitions(conn)
+        print(f"✅ UserMessages секционирована, старые строки в usermessages_legacy (до {upper:%Y-%m-%d}).")
+
+if __name__ == '__main__':
+    try:
+        partition_user_messages()
+    finally:
+        close_pool()
@@ -0,0 +1,60 @@
+import sys
+from dotenv import load_dotenv
+from database import (pooled_connection, init_db_if_not_exists, close_pool,
+                      is_user_messages_partitioned, create_message_indexes)
+
+load_dotenv()
+
+BACKFILL_BATCH = 20000
+
+# Rows logged before original_id existed only have "Found: <brand> <name>[ | NOTE: ...]"
+# in notes. The stage they matched at is unknown, so they get 'legacy'.
+BACKFILL_QUERY = """
+    UPDATE UserMessages m
+    SET original_id = o.id,
+        match_stage = 'legacy',
+        is_fuzzy = m.notes LIKE '%% | NOTE:%%'
+    FROM OriginalPerfume o
+    WHERE m.id > %s AND m.id <= %s
+      AND m.status = 'success' AND m.original_id IS NULL
+      AND m.notes LIKE 'Found: %%'
+      AND TRIM(split_part(substr(m.notes, 8), ' | NOTE:', 1))
+          = TRIM(COALESCE(o.brand, '') || ' ' || COALESCE(o.name, ''))
+"""
+
+def backfill_search_log(batch_size=BACKFILL_BATCH):
+    """
+    Adds the structured columns, fills original_id / is_fuzzy for old success
+    rows in id ranges (committing after each range so the table is never locked
+    for long), then builds the indexes with CREATE INDEX CONCURRENTLY so logging
+    goes on meanwhile. Safe to re-run: filled rows and built indexes are skipped.
+    """
+    with pooled_connection() as conn:
+        init_db_if_not_exists(conn)
+        cur = conn.cursor()
+        cur.execute("SELECT MIN(id), MAX(id) FROM UserMessages")
+        first_id, last_id = cur.fetchone()
+        updated = 0
+        for start in range(first_id - 1 if first_id else 0, last_id or 0, batch_size):
+            cur.execute(BACKFILL_QUERY, (start, start + batch_size))
+            updated += cur.rowcount
+            conn.commit()
+            print(f"  id {start + 1}..{min(start + batch_size, last_id)}: обновлено {updated}")
+        conn.commit()
+
+        # A partitioned UserMessages is always created with its indexes.
+        if not is_user_messages_partitioned(conn):
+            print("Построение индексов UserMessages (CONCURRENTLY)...")
+            conn.autocommit = True
+            try:
+                create_message_indexes(conn, concurrently=True)
+            finally:
+                conn.autocommit = False
+    print(f"✅ Миграция завершена, заполнено строк: {updated}")
+    return updated
+
+if __name__ == '__main__':
+    try:
+        backfill_search_log(int(sys.argv[1]) if len(sys.argv) > 1 else BACKFILL_BATCH)
+    finally:
+        close_pool()
@@ -0,0 +1,244 @@
+import os
+import time
+import heapq
+import queue
+import itertools
+import threading
+from collections import deque
+from telebot.apihelper import ApiTelegramException
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+OUTBOX_QUEUE_MAXSIZE = int(os.getenv("OUTBOX_QUEUE_MAXSIZE", 1000))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 25))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", 1))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", 3))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", 3))
+OUTBOX_MAX_AGE = float(os.getenv("OUTBOX_MAX_AGE", 60))
+OUTBOX_GLOBAL_429_CHATS = int(os.getenv("OUTBOX_GLOBAL_429_CHATS", 3))
+CHAT_BUCKET_IDLE = 300
+
+class TokenBucket:
+    """
+    try_acquire() takes a token when one is available, otherwise it takes
+    nothing and returns how long until one will be, so workers can serve
+    other chats in the meantime instead of sleeping.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def release(self):
+        """Gives back a token taken by try_acquire when the call was not made after all."""
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def pause(self, seconds):
+        """Used for 429 retry_after: nothing goes out through this bucket for `seconds`."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 1.0) - seconds * self.rate
+
+_bot = None
+_global_bucket = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+_chat_buckets = {}
+_chat_buckets_lock = threading.Lock()
+_last_bucket_sweep = time.monotonic()
+_limited_chats = {}
+_limited_chats_lock = threading.Lock()
+_queues = [queue.Queue(maxsize=OUTBOX_QUEUE_MAXSIZE) for _ in range(OUTBOX_WORKERS)]
+# Per worker: chat_id -> deque of jobs waiting for that chat's turn.
+_pending = [{} for _ in range(OUTBOX_WORKERS)]
+_sequence = itertools.count()
+_workers = []
+_workers_lock = threading.Lock()
+_stats = {"queued": 0, "sent": 0, "dropped": 0, "expired": 0, "retried": 0, "failed": 0,
+          "global_pauses": 0, "latency_ms_total": 0.0, "latency_ms_max": 0.0}
+_stats_lock = threading.Lock()
+
+def set_outbox_bot(bot):
+    """"""
+    global _bot
+    _bot = bot
+
+def _chat_bucket(chat_id):
+    global _last_bucket_sweep
+    with _chat_buckets_lock:
+        now = time.monotonic()
+        if now - _last_bucket_sweep > CHAT_BUCKET_IDLE:
+            _last_bucket_sweep = now
+            for idle in [c for c, b in _chat_buckets.items() if now - b.updated > CHAT_BUCKET_IDLE]:
+                del _chat_buckets[idle]
+        bucket = _chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = _chat_buckets[chat_id] = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+        return bucket
+
+def _count(outcome, queued_at=None):
+    with _stats_lock:
+        _stats[outcome] += 1
+        if queued_at is not None:
+            latency = (time.monotonic() - queued_at) * 1000
+            _stats["latency_ms_total"] += latency
+            _stats["latency_ms_max"] = max(_stats["latency_ms_max"], latency)
+
+def _rate_limited(chat_id, bucket, retry_after):
+    """
+    A 429 holds back only its own chat. When OUTBOX_GLOBAL_429_CHATS different
+    chats are inside a retry_after window at once, the bot as a whole is over
+    Telegram's limit and the global bucket is paused too.
+    """
+    bucket.release()
+    bucket.pause(retry_after)
+    now = time.monotonic()
+    with _limited_chats_lock:
+        _limited_chats[chat_id] = now + retry_after
+        for chat in [c for c, until in _limited_chats.items() if until <= now]:
+            del _limited_chats[chat]
+        is_global = len(_limited_chats) >= OUTBOX_GLOBAL_429_CHATS
+    if is_global:
+        _global_bucket.pause(retry_after)
+        _count("global_pauses")
+
+def _serve(chat_id, jobs):
+    """
+    Makes the oldest call queued for one chat, if its chat and the global
+    bucket allow it. Returns how long to wait before trying this chat again.
+    """
+    while jobs and time.monotonic() - jobs[0][3] > OUTBOX_MAX_AGE:
+        jobs.popleft()
+        _count("expired")
+    if not jobs:
+        return 0.0
+
+    bucket = _chat_bucket(chat_id)
+    wait = bucket.try_acquire()
+    if wait:
+        return wait
+    wait = _global_bucket.try_acquire()
+    if wait:
+        bucket.release()
+        return wait
+
+    job = jobs[0]
+    method, args, kwargs, queued_at, attempts = job
+    try:
+        getattr(_bot, method)(*args, **kwargs)
+    except ApiTelegramException as e:
+        if e.error_code == 429 and attempts < OUTBOX_MAX_RETRIES:
+            retry_after = ((e.result_json or {}).get("parameters") or {}).get("retry_after", 1)
+            job[4] += 1
+            _count("retried")
+            _rate_limited(chat_id, bucket, retry_after)
+            return retry_after
+        print(f"❌ Не удалось выполнить {method} для чата {chat_id}: {e}")
+        _count("failed")
+    except Exception as e:
+        print(f"❌ Не удалось выполнить {method} для чата {chat_id}: {e}")
+        _count("failed")
+    else:
+        _count("sent", queued_at)
+    jobs.popleft()
+    return 0.0
+
+def _run(inbox, pending):
+    """
+    One worker: takes new jobs from `inbox` into per-chat FIFOs and serves the
+    chats from a heap of ready times, so a chat waiting for its bucket or a
+    429 never holds up the other chats of this worker.
+    """
+    ready = []
+    while True:
+        timeout = max(0.0, ready[0][0] - time.monotonic()) if ready else None
+        try:
+            chat_id, job = inbox.get(timeout=timeout)
+        except queue.Empty:
+            pass
+        else:
+            if chat_id not in pending:
+                pending[chat_id] = deque()
+                heapq.heappush(ready, (time.monotonic(), next(_sequence), chat_id))
+            pending[chat_id].append(job)
+
+        if not ready or ready[0][0] > time.monotonic():
+            continue
+        _, _, chat_id = heapq.heappop(ready)
+        jobs = pending[chat_id]
+        wait = _serve(chat_id, jobs)
+        if jobs:
+            heapq.heappush(ready, (time.monotonic() + wait, next(_sequence), chat_id))
+        else:
+            del pending[chat_id]
+
+def _ensure_workers():
+    if len(_workers) == OUTBOX_WORKERS and all(t.is_alive() for t in _workers):
+        return
+    with _workers_lock:
+        for i, inbox in enumerate(_queues):
+            if i < len(_workers) and _workers[i].is_alive():
+                continue
+            worker = threading.Thread(target=_run, args=(inbox, _pending[i]),
+                                      name=f"outbox-worker-{i}", daemon=True)
+            worker.start()
+            if i < len(_workers):
+                _workers[i] = worker
+            else:
+                _workers.append(worker)
+
+def enqueue(chat_id, method, *args, **kwargs):
+    """
+    Queues bot.<method>(*args, **kwargs). Calls for one chat go through one
+    worker in order, throttled by the chat's and the global token bucket; a
+    429 is retried after Telegram's retry_after while the worker keeps serving
+    other chats. Returns False when the queue is full and the call was dropped.
+    """
+    if _bot is None:
+        raise RuntimeError("set_outbox_bot() must be called before sending.")
+    _ensure_workers()
+    inbox = _queues[hash(chat_id) % OUTBOX_WORKERS]
+    try:
+        inbox.put_nowait((chat_id, [method, args, kwargs, time.monotonic(), 0]))
+    except queue.Full:
+        _count("dropped")
+        return False
+    _count("queued")
+    return True
+
+def send_message(chat_id, text, **kwargs):
+    return enqueue(chat_id, "send_message", chat_id, text, **kwargs)
+
+def reply_to(message, text, **kwargs):
+    return enqueue(message.chat.id, "reply_to", message, text, **kwargs)
+
+def edit_message_text(text, chat_id, message_id, **kwargs):
+    return enqueue(chat_id, "edit_message_text", text, chat_id, message_id, **kwargs)
+
+def delete_message(chat_id, message_id):
+    return enqueue(chat_id, "delete_message", chat_id, message_id)
+
+def get_outbox_stats():
+    """"""
+    depths = [inbox.qsize() for inbox in _queues]
+    depths += [len(jobs) for pending in _pending for jobs in list(pending.values())]
+    with _stats_lock:
+        stats = dict(_stats)
+    done = stats["sent"]
+    stats["latency_ms_avg"] = stats.pop("latency_ms_total") / done if done else 0.0
+    stats["depth"] = sum(depths)
+    stats["chats"] = len(_chat_buckets)
+    return stats
@@ -0,0 +1,81 @@
+from search import find_original, get_copies, random_original
+from formatter import format_response, format_popular_list, format_history_list
+from i18n import get_message
+from log_writer import enqueue_log
+import keyboards
+
+# Texts and send options shared by web.py and web_async.py: each returns
+# (text, kwargs) for outbox.send_message / outbox.reply_to, so the two apps
+# only differ in how they read state and caches.
+
+def menu_reply(lang):
+    """"""
+    welcome_msg = get_message("welcome", lang)
+    menu_text = get_message("menu_main_text", lang)
+    return f"{welcome_msg}\n\n{menu_text}", dict(reply_markup=keyboards.main_menu(lang),
+                                                 parse_mode='Markdown')
+
+def search_prompt_reply(lang):
+    """"""
+    return get_message("search_prompt", lang), dict(reply_markup=keyboards.back_to_menu(lang),
+                                                     parse_mode='Markdown')
+
+def popular_reply(popular_perfumes, lang):
+    """"""
+    return format_popular_list(popular_perfumes, lang), dict(reply_markup=keyboards.back_to_menu(lang),
+                                                             parse_mode='Markdown')
+
+def history_reply(history_items, lang):
+    """"""
+    return format_history_list(history_items, lang), dict(reply_markup=keyboards.back_to_menu(lang),
+                                                          parse_mode='Markdown')
+
+def random_reply(chat_id, lang):
+    """"""
+    original = random_original(chat_id)
+    if not original:
+        return "Sorry, I couldn't find any perfume.", dict(reply_markup=keyboards.after_random_menu(lang))
+
+    copies = get_copies(original["id"])
+    response_text = format_response(original, copies, lang)
+    title = get_message("random_title", lang)
+    return f"**{title}**\n\n{response_text}", dict(parse_mode='Markdown',
+                                                 disable_web_page_preview=True,
+                                                 reply_markup=keyboards.after_random_menu(lang))
+
+def search_reply(msg, lang):
+    """
+    Looks up the query in `msg` and logs the outcome. Returns (found, text,
+    kwargs); the caller clears the search state and schedules the follow-up
+    when found.
+    """
+    user_text = msg.text.strip()
+    if not user_text:
+        enqueue_log(msg.chat.id, msg.text, 'fail', 'Empty query')
+        return False, get_message("error_empty_query", lang), dict(parse_mode='Markdown')
+
+    result = find_original(None, user_text, lang=lang)
+
+    if not result["ok"]:
+        enqueue_log(msg.chat.id, msg.text, 'fail', result['message'], match_stage=result.get('stage'))
+        return False, result['message'], dict(parse_mode='Markdown')
+
+    original = result["original"]
+    copies = get_copies(original["id"])
+
+    log_note = f"Found: {original['brand']} {original['name']}"
+    if 'note' in result:
+        log_note += f" | NOTE: {result['note']}"
+
+    enqueue_log(msg.chat.id, msg.text, 'success', log_note,
+                original_id=original['id'], match_stage=result['stage'], is_fuzzy='note' in result)
+
+    response_text = format_response(original, copies, lang=lang)
+
+    if 'note' in result:
+        note_prefix = get_message("response_note_prefix", lang)
+        response_text = f"{note_prefix}{result['note']} \n\n" + response_text
+
+    return True, response_text, dict(parse_mode='Markdown',
+                                     disable_web_page_preview=True,
+                                     reply_markup=keyboards.after_search_menu(lang))
@@ -0,0 +1,54 @@
+import os
+import sys
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from psycopg2 import sql
+from database import (pooled_connection, close_pool, is_user_messages_partitioned,
+                      ensure_message_partitions, list_message_partitions,
+                      drop_message_partition, _month_start)
+from rollups import refresh_rollups, fetch_rollup_watermark
+
+load_dotenv()
+
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", 12))
+
+def run_retention(conn, retention_months=LOG_RETENTION_MONTHS, now=None):
+    """
+    Daily job for the partitioned UserMessages: creates the coming months'
+    partitions, folds new rows into the rollups, then drops partitions that
+    ended more than retention_months ago. Their counts live on in the rollups;
+    a partition holding rows the rollups have not reached yet is kept.
+    Returns the dropped partition names.
+    """
+    if not is_user_messages_partitioned(conn):
+        print("UserMessages не секционирована, запустите migrate_partition_messages.py.")
+        return []
+
+    ensure_message_partitions(conn, now=now)
+    refresh_rollups(conn)
+    rolled_up_to = fetch_rollup_watermark(conn)[0]
+    conn.commit()
+    cutoff = _month_start(now or datetime.now(timezone.utc), -retention_months)
+
+    dropped = []
+    cur = conn.cursor()
+    for name, lower, upper in list_message_partitions(conn):
+        if upper is None or upper > cutoff:
+            continue
+        cur.execute(sql.SQL("SELECT MAX(id) FROM {}").format(sql.Identifier(name)))
+        max_id = cur.fetchone()[0]
+        conn.commit()
+        if max_id is not None and max_id > rolled_up_to:
+            print(f"⚠️ {name} ещё не учтена в агрегатах, пропуск.")
+            continue
+        drop_message_partition(conn, name)
+        dropped.append(name)
+        print(f"✅ Удалена секция {name}")
+    return dropped
+
+if __name__ == '__main__':
+    try:
+        with pooled_connection() as conn:
+            run_retention(conn, int(sys.argv[1]) if len(sys.argv) > 1 else LOG_RETENTION_MONTHS)
+    finally:
+        close_pool()
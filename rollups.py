@@ -0,0 +1,171 @@
+import os
+import sys
+from dotenv import load_dotenv
+from database import pooled_connection, close_pool
+
+load_dotenv()
+
+ROLLUP_BATCH = int(os.getenv("ROLLUP_BATCH", 50000))
+# SERIAL ids are handed out before commit, so a lower id can become visible
+# after a higher one. Rows younger than this are left for the next run.
+ROLLUP_LAG_SECONDS = int(os.getenv("ROLLUP_LAG_SECONDS", 300))
+WATERMARK_NAME = "usermessages"
+
+ROLLUP_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS RollupWatermark (
+        name TEXT PRIMARY KEY,
+        last_id BIGINT NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now() )""",
+    """
+    CREATE TABLE IF NOT EXISTS DailySearchStats (
+        day DATE NOT NULL,
+        original_id TEXT NOT NULL,
+        success_count BIGINT NOT NULL,
+        fuzzy_count BIGINT NOT NULL,
+        last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+        PRIMARY KEY (day, original_id) )""",
+    """
+    CREATE TABLE IF NOT EXISTS DailyFailStats (
+        day DATE NOT NULL,
+        query_norm TEXT NOT NULL,
+        fail_count BIGINT NOT NULL,
+        last_note TEXT,
+        last_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+        PRIMARY KEY (day, query_norm) )""",
+    """
+    CREATE TABLE IF NOT EXISTS DailyUserActivity (
+        day DATE NOT NULL,
+        user_id BIGINT NOT NULL,
+        message_count BIGINT NOT NULL,
+        success_count BIGINT NOT NULL,
+        fail_count BIGINT NOT NULL,
+        last_activity TIMESTAMP WITH TIME ZONE NOT NULL,
+        PRIMARY KEY (day, user_id) )""",
+    """
+    CREATE TABLE IF NOT EXISTS DailyStageStats (
+        day DATE NOT NULL,
+        status TEXT NOT NULL,
+        match_stage TEXT NOT NULL,
+        message_count BIGINT NOT NULL,
+        PRIMARY KEY (day, status, match_stage) )""",
+)
+
+# Each statement folds the UserMessages rows with lo < id <= hi into the
+# rollups; counters are added to what is already there.
+ROLLUP_STATEMENTS = (
+    """
+    INSERT INTO DailySearchStats (day, original_id, success_count, fuzzy_count, last_seen)
+    SELECT (timestamp AT TIME ZONE 'UTC')::date, original_id,
+           COUNT(*), COUNT(*) FILTER (WHERE is_fuzzy), MAX(timestamp)
+    FROM UserMessages
+    WHERE id > %(lo)s AND id <= %(hi)s AND status = 'success' AND original_id IS NOT NULL
+    GROUP BY 1, 2
+    ON CONFLICT (day, original_id) DO UPDATE SET
+        success_count = DailySearchStats.success_count + EXCLUDED.success_count,
+        fuzzy_count = DailySearchStats.fuzzy_count + EXCLUDED.fuzzy_count,
+        last_seen = GREATEST(DailySearchStats.last_seen, EXCLUDED.last_seen)
+    """,
+    r"""
+    INSERT INTO DailyFailStats (day, query_norm, fail_count, last_note, last_seen)
+    SELECT day, query_norm, COUNT(*),
+           (array_agg(notes ORDER BY timestamp DESC))[1], MAX(timestamp)
+    FROM (
+        SELECT (timestamp AT TIME ZONE 'UTC')::date AS day,
+               lower(regexp_replace(btrim(message), '\s+', ' ', 'g')) AS query_norm,
+               notes, timestamp
+        FROM UserMessages
+        WHERE id > %(lo)s AND id <= %(hi)s AND status = 'fail' AND message NOT IN ('/start')
+    ) f
+    GROUP BY day, query_norm
+    ON CONFLICT (day, query_norm) DO UPDATE SET
+        fail_count = DailyFailStats.fail_count + EXCLUDED.fail_count,
+        last_note = CASE WHEN EXCLUDED.last_seen >= DailyFailStats.last_seen
+                         THEN EXCLUDED.last_note ELSE DailyFailStats.last_note END,
+        last_seen = GREATEST(DailyFailStats.last_seen, EXCLUDED.last_seen)
+    """,
+    """
+    INSERT INTO DailyUserActivity (day, user_id, message_count, success_count, fail_count, last_activity)
+    SELECT (timestamp AT TIME ZONE 'UTC')::date, user_id, COUNT(*),
+           COUNT(*) FILTER (WHERE status = 'success'),
+           COUNT(*) FILTER (WHERE status = 'fail'),
+           MAX(timestamp)
+    FROM UserMessages
+    WHERE id > %(lo)s AND id <= %(hi)s
+    GROUP BY 1, 2
+    ON CONFLICT (day, user_id) DO UPDATE SET
+        message_count = DailyUserActivity.message_count + EXCLUDED.message_count,
+        success_count = DailyUserActivity.success_count + EXCLUDED.success_count,
+        fail_count = DailyUserActivity.fail_count + EXCLUDED.fail_count,
+        last_activity = GREATEST(DailyUserActivity.last_activity, EXCLUDED.last_activity)
+    """,
+    """
+    INSERT INTO DailyStageStats (day, status, match_stage, message_count)
+    SELECT (timestamp AT TIME ZONE 'UTC')::date, status, match_stage, COUNT(*)
+    FROM UserMessages
+    WHERE id > %(lo)s AND id <= %(hi)s AND match_stage IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (day, status, match_stage) DO UPDATE SET
+        message_count = DailyStageStats.message_count + EXCLUDED.message_count
+    """,
+)
+
+def ensure_rollup_tables(conn):
+    cur = conn.cursor()
+    for ddl in ROLLUP_TABLES:
+        cur.execute(ddl)
+    cur.execute(
+        "INSERT INTO RollupWatermark (name, last_id) VALUES (%s, 0) ON CONFLICT DO NOTHING",
+        (WATERMARK_NAME,),
+    )
+    conn.commit()
+
+def _rollup_upper_bound(cur):
+    cur.execute(
+        "SELECT MAX(id) FROM UserMessages WHERE timestamp < now() - make_interval(secs => %s)",
+        (ROLLUP_LAG_SECONDS,),
+    )
+    return cur.fetchone()[0] or 0
+
+def refresh_rollups(conn, batch_size=ROLLUP_BATCH):
+    """
+    Folds UserMessages rows added since the last run into the daily rollups,
+    batch_size ids per transaction. Each batch and its watermark commit
+    together, and the watermark row is locked, so rows are counted exactly
+    once even with concurrent runs. Returns the number of ids covered.
+    """
+    ensure_rollup_tables(conn)
+    cur = conn.cursor()
+    upper = _rollup_upper_bound(cur)
+    conn.commit()
+
+    covered = 0
+    while True:
+        cur.execute("SELECT last_id FROM RollupWatermark WHERE name = %s FOR UPDATE", (WATERMARK_NAME,))
+        lo = cur.fetchone()[0]
+        if lo >= upper:
+            conn.commit()
+            return covered
+        hi = min(lo + batch_size, upper)
+        for statement in ROLLUP_STATEMENTS:
+            cur.execute(statement, {"lo": lo, "hi": hi})
+        cur.execute(
+            "UPDATE RollupWatermark SET last_id = %s, updated_at = now() WHERE name = %s",
+            (hi, WATERMARK_NAME),
+        )
+        conn.commit()
+        covered += hi - lo
+
+def fetch_rollup_watermark(conn):
+    """"""
+    cur = conn.cursor()
+    cur.execute("SELECT last_id, updated_at FROM RollupWatermark WHERE name = %s", (WATERMARK_NAME,))
+    return cur.fetchone()
+
+if __name__ == '__main__':
+    try:
+        with pooled_connection() as conn:
+            covered = refresh_rollups(conn, int(sys.argv[1]) if len(sys.argv) > 1 else ROLLUP_BATCH)
+        print(f"✅ Агрегаты обновлены, обработано id: {covered}")
+    finally:
+        close_pool()
@@ -1,100 +1,535 @@
-from rapidfuzz import fuzz
+import os
+import time
+import pickle
+import random
+import threading
+from array import array
+from collections import Counter, OrderedDict, deque
+from cachetools import TTLCache
+from rapidfuzz import fuzz, process
 from rapidfuzz.fuzz import WRatio
 from utils import normalize_for_match
-from database import fetch_all_originals, fetch_clones_for_search, fetch_original_by_id
+from database import fetch_all_originals, fetch_clones_for_search, fetch_catalog_version, pooled_connection
+from database import bump_catalog_version
 from i18n import get_message 
 
+# The whole in-memory catalog (see build_catalog), replaced as one object.
 CATALOG = None
-BRAND_MAP = None
-NAME_MAP = None
-CLONE_CATALOG = None
 
-def _load_catalog(conn):
+ORIGINAL_FIELDS = ("id", "brand", "name", "brand_norm", "name_norm", "display_norm")
+
+NGRAM_SIZE = 3
+CANDIDATE_LIMIT = 64
+# Grams found in more values than this say little about a match and cost the
+# most to count (" de", "the"); they are skipped unless the query has no other.
+NGRAM_MAX_POSTINGS = int(os.getenv("NGRAM_MAX_POSTINGS", 400))
+# Postings counted per query at most: the rarest grams are taken first until
+# this is reached, which keeps the cost per query flat as the catalog grows.
+NGRAM_POSTINGS_BUDGET = int(os.getenv("NGRAM_POSTINGS_BUDGET", 1500))
+BRAND_SCOPED_MIN_SCORE = 85
+
+SEARCH_CACHE_MAXSIZE = 4096
+SEARCH_CACHE_TTL = 6 * 3600
+CATALOG_CHECK_INTERVAL = int(os.getenv("CATALOG_CHECK_INTERVAL", 60))
+SEARCH_SNAPSHOT_PATH = os.getenv("SEARCH_SNAPSHOT_PATH", os.path.join("data", "search_snapshot.pkl"))
+# Bump whenever build_catalog changes what it produces, so old files are ignored.
+SNAPSHOT_FORMAT = 4
+RANDOM_WEIGHTING = os.getenv("RANDOM_WEIGHTING", "uniform")
+RANDOM_NO_REPEAT = int(os.getenv("RANDOM_NO_REPEAT", 20))
+RANDOM_HISTORY_CHATS = 10000
+
+_reload_lock = threading.Lock()
+_watcher = None
+
+_recent_random = OrderedDict()
+_recent_random_lock = threading.Lock()
+
+_search_cache = TTLCache(maxsize=SEARCH_CACHE_MAXSIZE, ttl=SEARCH_CACHE_TTL)
+_search_cache_lock = threading.Lock()
+_search_cache_stats = {"hits": 0, "misses": 0}
+_catalog_generation = 0
+
+# Score table rows: (catalog field, score the reversed query, lowest threshold
+# any stage applies to the row). Each row is scored at most once per query.
+SCORE_ROWS = {
+    "display": ("display_norm", False, 85),
+    "reversed": ("display_norm", True, 95),
+    "name": ("name_norm", False, 90),
+    "brand": ("brand_norm", False, 90),
+}
+
+# Decision rules, checked in order: (row, min_score, outcome, stage name
+# recorded in the search log).
+MATCH_STAGES = (
+    ("display", 100, "found", "exact"),
+    ("reversed", 95, "fuzzy", "reversed"),
+    ("name", 90, "found", "name"),
+    ("clone", 80, "clone", "clone"),
+    ("brand", 90, "brand_only", "brand"),
+    ("display", 85, "fuzzy", "fuzzy"),
+)
+
+class PackedStrings:
+    """
+    Read-only sequence of strings kept as one str plus an array of offsets.
+    Indexing slices a new string out of the buffer, so reading a value never
+    writes to the refcount of an object shared between forked workers.
     """
+    __slots__ = ("buffer", "offsets")
+
+    def __init__(self, values):
+        offsets, end = array("I", [0]), 0
+        for value in values:
+            end += len(value)
+            offsets.append(end)
+        self.buffer = "".join(values)
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+def _ngrams(text):
     """
-    global CATALOG, BRAND_MAP, NAME_MAP, CLONE_CATALOG
+    Character trigrams of the padded text plus its whole tokens.
+    """
+    padded = f" {text} "
+    grams = {padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)}
+    grams.update(text.split())
+    return grams
+
+def _build_ngram_index(column):
+    """
+    Inverted index over the distinct values of a catalog column: `records` holds
+    the first record carrying each value, each n-gram lists the positions of the
+    values containing it, and `positions` answers exact lookups.
+    """
+    values, records, positions, grams = [], array("I"), {}, {}
+    for record, value in enumerate(column):
+        if value in positions:
+            continue
+        positions[value] = len(values)
+        for gram in _ngrams(value):
+            grams.setdefault(gram, array("I")).append(len(values))
+        values.append(value)
+        records.append(record)
+    return {"values": PackedStrings(values), "records": records, "grams": grams, "positions": positions}
+
+def _candidates(user_norm, index, limit=CANDIDATE_LIMIT):
+    """
+    Positions of the values sharing the most n-grams with the query, in catalog
+    order, or None when the whole column is small enough to score directly.
+
+    Grams are counted rarest first, skipping those in more than
+    NGRAM_MAX_POSTINGS values and stopping at NGRAM_POSTINGS_BUDGET postings,
+    so the work per query does not grow with the catalog. Ties are broken by
+    the rarest gram a value shares (Counter keeps first-seen order).
+    """
+    if len(index["values"]) <= limit:
+        return None
+    grams = index["grams"]
+    postings = sorted((len(grams[gram]), gram) for gram in _ngrams(user_norm) if gram in grams)
+    counts, counted = Counter(), 0
+    for size, gram in postings:
+        if counted and (size > NGRAM_MAX_POSTINGS or counted + size > NGRAM_POSTINGS_BUDGET):
+            break
+        counts.update(grams[gram])
+        counted += size
+    return sorted(pos for pos, _ in counts.most_common(limit))
+
+def get_search_cache_stats():
+    """"""
+    with _search_cache_lock:
+        return {**_search_cache_stats, "size": len(_search_cache)}
+
+def clear_search_cache():
+    """
+    Drops every cached result; results computed against the previous catalog
+    that are still in flight will not be stored.
+    """
+    global _catalog_generation
+    with _search_cache_lock:
+        _search_cache.clear()
+        _catalog_generation += 1
+
+def _saved_amount_key(copy):
+    """Same ordering as format_response: biggest saving first, unknown last."""
+    return copy.get("saved_amount") if copy.get("saved_amount") is not None else -1
 
-    rows = fetch_all_originals(conn)
-    catalog, brand_map, name_map = [], {}, {}
+def build_catalog(rows, clone_rows, version=None):
+    """
+    Builds a complete catalog snapshot from OriginalPerfume and CopyPerfume rows.
+    Nothing global is touched, so it can run in a background thread while the
+    current snapshot keeps serving searches.
+
+    Originals are stored column-wise: each text column (and each index's
+    values) is one PackedStrings buffer and record numbers are int arrays, so
+    scoring candidates and building results read the strings without writing
+    to their pages. Searches still bump the refcounts of a few dozen small
+    containers (n-gram posting arrays, copy_ranges tuples, copy rows of the
+    result), so a long-running worker does un-share those pages.
+    """
+    originals = {field: [] for field in ORIGINAL_FIELDS}
+    original_records, brand_records = {}, {}
     for r in rows:
-        item = {
-            "id": r["id"],
-            "brand": r["brand"] or "",
-            "name": r["name"] or "",
-            "brand_norm": normalize_for_match(r["brand"]),
-            "name_norm": normalize_for_match(r["name"]),
-            "display_norm": normalize_for_match(f"{r['brand']} {r['name']}"),
-        }
-        catalog.append(item)
-        brand_map.setdefault(item["brand_norm"], []).append(item)
-        name_map.setdefault(item["name_norm"], []).append(item)
-
-    clone_rows = fetch_clones_for_search(conn)
-    clone_catalog = []
+        record = len(originals["id"])
+        brand_norm = normalize_for_match(r["brand"])
+        originals["id"].append(r["id"])
+        originals["brand"].append(r["brand"] or "")
+        originals["name"].append(r["name"] or "")
+        originals["brand_norm"].append(brand_norm)
+        originals["name_norm"].append(normalize_for_match(r["name"]))
+        originals["display_norm"].append(normalize_for_match(f"{r['brand']} {r['name']}"))
+        original_records[r["id"]] = record
+        brand_records.setdefault(brand_norm, array("I")).append(record)
+
+    clones = {"display_norm": [], "original": array("i")}
+    groups = {}
     for r in clone_rows:
-        item = {
-            "brand": r["brand"] or "",
-            "name": r["name"] or "",
-            "display_norm": normalize_for_match(f"{r['brand']} {r['name']}"),
-            "original_id": r["original_id"],
-        }
-        clone_catalog.append(item)
+        clones["display_norm"].append(normalize_for_match(f"{r['brand']} {r['name']}"))
+        clones["original"].append(original_records.get(r["original_id"], -1))
+        groups.setdefault(r["original_id"], []).append(r)
+
+    copy_fields = tuple(clone_rows[0].keys()) if clone_rows else ()
+    copies = {field: [] for field in copy_fields}
+    copy_ranges = {}
+    for original_id, group in groups.items():
+        group.sort(key=_saved_amount_key, reverse=True)
+        start = len(copies[copy_fields[0]])
+        for r in group:
+            for field in copy_fields:
+                copies[field].append(r[field])
+        copy_ranges[original_id] = (start, start + len(group))
+
+    originals = {field: PackedStrings(values) for field, values in originals.items()}
+    clones["display_norm"] = PackedStrings(clones["display_norm"])
+
+    copy_counts = [0] * len(originals["id"])
+    for original_id, (start, stop) in copy_ranges.items():
+        if original_id in original_records:
+            copy_counts[original_records[original_id]] = stop - start
 
+    return {
+        "version": version,
+        "random_by_copies": _build_alias_table(copy_counts),
+        "originals": originals,
+        "original_records": original_records,
+        "brand_records": brand_records,
+        "clones": clones,
+        "copy_fields": copy_fields,
+        "copies": copies,
+        "copy_ranges": copy_ranges,
+        "catalog_index": {
+            key: _build_ngram_index(originals[key])
+            for key in ("display_norm", "name_norm", "brand_norm")
+        },
+        "clone_index": {"display_norm": _build_ngram_index(clones["display_norm"])},
+    }
+
+def _build_alias_table(weights):
+    """
+    Walker/Vose alias table: one uniform draw plus one coin flip picks record
+    i with probability weights[i] / sum(weights). None when all weights are 0.
+    """
+    n, total = len(weights), sum(weights)
+    if not n or not total:
+        return None
+    scaled = [w * n / total for w in weights]
+    prob, alias = array("d", [1.0] * n), array("I", range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less], alias[less] = scaled[less], more
+        scaled[more] -= 1 - scaled[less]
+        (small if scaled[more] < 1 else large).append(more)
+    return {"prob": prob, "alias": alias}
+
+def _original_item(catalog, record):
+    """The original at `record` as the dict handlers and formatters expect."""
+    originals = catalog["originals"]
+    return {field: originals[field][record] for field in ORIGINAL_FIELDS}
+
+def install_catalog(catalog):
+    """
+    Makes `catalog` the one searches use. A single reference assignment:
+    searches already running finish on the snapshot they started with.
+    """
+    global CATALOG
     CATALOG = catalog
-    BRAND_MAP = brand_map
-    NAME_MAP = name_map
-    CLONE_CATALOG = clone_catalog
+    clear_search_cache()
+
+def save_catalog_snapshot(catalog, path=SEARCH_SNAPSHOT_PATH):
+    """
+    Writes a built catalog to `path` for load_catalog_snapshot. The file is
+    replaced atomically, so a worker never reads a half-written snapshot.
+    """
+    payload = {"format": SNAPSHOT_FORMAT, "version": catalog["version"], "catalog": catalog}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+def load_catalog_snapshot(version, path=SEARCH_SNAPSHOT_PATH):
+    """
+    The catalog stored at `path` if it was built by this code for catalog
+    `version`, else None. An unknown version (None) never matches.
+    """
+    if version is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except Exception as e:
+        print(f"❌ Не удалось прочитать снимок каталога {path}: {e}")
+        return None
+    if payload.get("format") != SNAPSHOT_FORMAT or payload.get("version") != version:
+        print(f"Снимок каталога {path} устарел, загрузка из БД.")
+        return None
+    return payload["catalog"]
 
-def init_catalog(conn):
+def _load_catalog(conn):
+    """
+    Installs the prebuilt snapshot when it matches the DB's catalog version,
+    otherwise builds the catalog from the DB rows.
+    """
+    version = fetch_catalog_version(conn)
+    catalog = load_catalog_snapshot(version)
+    if catalog is None:
+        catalog = build_catalog(fetch_all_originals(conn), fetch_clones_for_search(conn), version)
+    install_catalog(catalog)
+
+def init_catalog(conn=None):
     """"""
-    _load_catalog(conn)
+    if conn is not None:
+        _load_catalog(conn)
+        return
+    with pooled_connection() as conn:
+        _load_catalog(conn)
 
-def _fuzzy_search_best(user_norm, search_space, target_key, min_score=90):
+def reload_catalog():
     """
+    Rebuilds the catalog from the DB and swaps it in. Returns False without
+    doing anything when another reload is already running.
     """
-    best_match, score = None, 0
-    
-    for item in search_space:
-        if item[target_key] == user_norm:
-            return {"ok": True, "result": item}
-
-    for item in search_space:
-        s = WRatio(user_norm, item[target_key])
-        if s > score:
-            best_match, score = item, s
-            
-    if best_match and score >= min_score:
-        return {"ok": True, "result": best_match}
-    
-    return {"ok": False, "result": None}
+    if not _reload_lock.acquire(blocking=False):
+        return False
+    try:
+        started = time.monotonic()
+        init_catalog()
+        print(f"✅ Каталог перезагружен (версия {CATALOG['version']}) за {time.monotonic() - started:.1f} с.")
+        return True
+    finally:
+        _reload_lock.release()
+
+def _reload_in_background(bump):
+    if bump:
+        try:
+            with pooled_connection() as conn:
+                version = bump_catalog_version(conn)
+            print(f"✅ Версия каталога повышена до {version}, остальные воркеры перезагрузят его.")
+        except Exception as e:
+            print(f"❌ Не удалось повысить версию каталога: {e}")
+    try:
+        reload_catalog()
+    except Exception as e:
+        print(f"❌ Не удалось перезагрузить каталог: {e}")
 
-def find_original_by_clone(conn, user_norm, lang="ru"):
+def request_catalog_reload(bump=False):
+    """
+    Starts reload_catalog in a background thread. With bump=True (the admin
+    command and SIGHUP) it first bumps CatalogVersion, so the watchers of all
+    other workers reload as well; this process reloads right away.
+    """
+    threading.Thread(target=_reload_in_background, args=(bump,), name="catalog-reload", daemon=True).start()
+
+def _watch_catalog_version(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            with pooled_connection() as conn:
+                version = fetch_catalog_version(conn)
+            if CATALOG is not None and version != CATALOG["version"]:
+                reload_catalog()
+        except Exception as e:
+            print(f"❌ Ошибка проверки версии каталога: {e}")
+
+def start_catalog_watcher(interval=CATALOG_CHECK_INTERVAL):
+    """
+    Polls CatalogVersion every `interval` seconds and reloads when an import
+    has bumped it. Does nothing when interval is 0.
+    """
+    global _watcher
+    if interval <= 0 or (_watcher is not None and _watcher.is_alive()):
+        return
+    _watcher = threading.Thread(target=_watch_catalog_version, args=(interval,),
+                                name="catalog-watcher", daemon=True)
+    _watcher.start()
+
+def get_copies(original_id):
+    """
+    Copies of an original, already sorted by saving. Served from memory; the
+    list is new on every call so callers may sort or trim it freely.
+    """
+    catalog = CATALOG
+    if not catalog or original_id not in catalog["copy_ranges"]:
+        return []
+    start, stop = catalog["copy_ranges"][original_id]
+    fields, copies = catalog["copy_fields"], catalog["copies"]
+    return [
+        dict(zip(fields, values))
+        for values in zip(*(copies[field][start:stop] for field in fields))
+    ]
+
+def _sample_record(catalog, weighting):
+    table = catalog["random_by_copies"] if weighting == "copies" else None
+    if table is None:
+        return random.randrange(len(catalog["originals"]["id"]))
+    record = random.randrange(len(table["prob"]))
+    return record if random.random() < table["prob"][record] else table["alias"][record]
+
+def random_original(chat_id=None, weighting=RANDOM_WEIGHTING, attempts=8):
+    """
+    A random original from the in-memory catalog, in constant time and without
+    SQL. weighting "copies" favours originals with more copies. The last
+    RANDOM_NO_REPEAT picks for chat_id are skipped (given a few redraws), so
+    asking again does not bring the same perfume straight back.
+    """
+    catalog = CATALOG
+    if not catalog or not catalog["originals"]["id"]:
+        return None
+
+    seen = ()
+    if chat_id is not None:
+        with _recent_random_lock:
+            recent = _recent_random.pop(chat_id, None) or deque(maxlen=RANDOM_NO_REPEAT)
+            _recent_random[chat_id] = recent
+            while len(_recent_random) > RANDOM_HISTORY_CHATS:
+                _recent_random.popitem(last=False)
+            seen = set(recent)
+
+    for _ in range(attempts):
+        record = _sample_record(catalog, weighting)
+        if catalog["originals"]["id"][record] not in seen:
+            break
+
+    original = _original_item(catalog, record)
+    if chat_id is not None:
+        with _recent_random_lock:
+            recent.append(original["id"])
+    return original
+
+def _fuzzy_search_best(user_norm, index, min_score=90):
+    """
+    """
+    exact = index["positions"].get(user_norm)
+    if exact is not None:
+        return {"ok": True, "record": index["records"][exact], "score": 100}
+
+    values = index["values"]
+    positions = _candidates(user_norm, index)
+    choices = list(values) if positions is None else [values[pos] for pos in positions]
+
+    best = process.extractOne(user_norm, choices, scorer=WRatio, score_cutoff=min_score)
+    if best:
+        pos = best[2] if positions is None else positions[best[2]]
+        return {"ok": True, "record": index["records"][pos], "score": best[1]}
+
+    return {"ok": False, "record": None, "score": 0}
+
+def _score_row(catalog, table, row, user_norm, user_norm_reversed):
+    """
+    Best match of a score table row, computed on first use and reused by every
+    later stage reading the same row.
+    """
+    if row not in table:
+        key, reverse, cutoff = SCORE_ROWS[row]
+        query = user_norm_reversed if reverse else user_norm
+        table[row] = _fuzzy_search_best(query, catalog["catalog_index"][key], min_score=cutoff)
+    return table[row]
+
+def _strip_brand(user_norm, brand_norm, min_score=90):
+    """
+    The query without its leading or trailing brand words, or "" when the brand
+    is not spelled out at either end.
+    """
+    words, size = user_norm.split(), len(brand_norm.split())
+    if len(words) <= size:
+        return ""
+    if WRatio(" ".join(words[:size]), brand_norm) >= min_score:
+        return " ".join(words[size:])
+    if WRatio(" ".join(words[-size:]), brand_norm) >= min_score:
+        return " ".join(words[:-size])
+    return ""
+
+def find_in_brand(catalog, user_norm, brand_norm, min_score=BRAND_SCOPED_MIN_SCORE):
+    """
+    Matches the rest of the query against the names of one brand only.
+    """
+    bucket = catalog["brand_records"].get(brand_norm)
+    name_query = _strip_brand(user_norm, brand_norm)
+    if not bucket or not name_query:
+        return None
+
+    name_norms = catalog["originals"]["name_norm"]
+    best = process.extractOne(name_query, [name_norms[record] for record in bucket],
+                              scorer=WRatio, score_cutoff=min_score)
+    return _original_item(catalog, bucket[best[2]]) if best else None
+
+def find_original_by_clone(catalog, user_norm, lang="ru"):
     """"""
-    search_result = _fuzzy_search_best(user_norm, CLONE_CATALOG, "display_norm", min_score=80)
+    search_result = _fuzzy_search_best(user_norm, catalog["clone_index"]["display_norm"], min_score=80)
     
     if search_result["ok"]:
-        found_clone = search_result["result"]
-        original_data = fetch_original_by_id(conn, found_clone["original_id"])
+        original_record = catalog["clones"]["original"][search_result["record"]]
         
-        if original_data:
-            original_item = {
-                "id": original_data["id"],
-                "brand": original_data["brand"],
-                "name": original_data["name"],
-                "brand_norm": normalize_for_match(original_data["brand"]),
-                "name_norm": normalize_for_match(original_data["name"]),
-                "display_norm": normalize_for_match(f"{original_data['brand']} {original_data['name']}"),
-            }
-            return {"ok": True, "original": original_item}
+        if original_record >= 0:
+            return {"ok": True, "original": _original_item(catalog, original_record)}
     
     return {"ok": False, "message": get_message("error_not_found", lang)}
 
 
+def _match_original(catalog, user_norm, lang):
+    """"""
+    user_norm_reversed = " ".join(user_norm.split()[::-1])
+
+    table = {}
+    for row, min_score, outcome, stage in MATCH_STAGES:
+        if outcome == "clone":
+            clone_search_result = find_original_by_clone(catalog, user_norm, lang)
+            if clone_search_result["ok"]:
+                return {**clone_search_result, "stage": stage}
+            continue
+
+        match = _score_row(catalog, table, row, user_norm, user_norm_reversed)
+        if not match["ok"] or match["score"] < min_score:
+            continue
+
+        if outcome == "brand_only":
+            scoped = find_in_brand(catalog, user_norm, catalog["originals"]["brand_norm"][match["record"]])
+            if scoped:
+                return {"ok": True, "original": scoped, "stage": "brand_scoped",
+                        "note": get_message("note_fuzzy_match", lang)}
+            brand_name = catalog["originals"]["brand"][match["record"]]
+            message = get_message("error_brand_only", lang).format(brand_name=brand_name)
+            return {"ok": False, "message": message, "stage": stage}
+
+        result = {"ok": True, "original": _original_item(catalog, match["record"]), "stage": stage}
+        if outcome == "fuzzy":
+            result["note"] = get_message("note_fuzzy_match", lang)
+        return result
+
+    return {"ok": False, "message": get_message("error_not_found", lang)}
+
+
 def find_original(conn, user_text, lang="ru"):
     """
     """
-    global CATALOG
-    
     if not user_text or not user_text.strip():
         return {"ok": False, "message": get_message("error_empty_query", lang)}
 
@@ -102,43 +537,21 @@ def find_original(conn, user_text, lang="ru"):
         init_catalog(conn)
 
     user_norm = normalize_for_match(user_text)
-    user_words = user_norm.split()
-    
-    
-    match = _fuzzy_search_best(user_norm, CATALOG, "display_norm", min_score=100)
-    if match["ok"]:
-        return {"ok": True, "original": match["result"]}
-
-    
-    user_norm_reversed = " ".join(user_words[::-1])
-    
-    match_rev = _fuzzy_search_best(user_norm_reversed, CATALOG, "display_norm", min_score=95)
-    if match_rev["ok"]:
-        note = get_message("note_fuzzy_match", lang) 
-        return {"ok": True, "original": match_rev["result"], "note": note}
+    key = (user_norm, lang)
 
-    
-    name_match = _fuzzy_search_best(user_norm, CATALOG, "name_norm", min_score=90)
-    if name_match["ok"]:
-        return {"ok": True, "original": name_match["result"]}
-
-    
-    clone_search_result = find_original_by_clone(conn, user_norm, lang)
-    if clone_search_result["ok"]:
-        return clone_search_result
+    with _search_cache_lock:
+        cached = _search_cache.get(key)
+        if cached is not None:
+            _search_cache_stats["hits"] += 1
+            return dict(cached)
+        _search_cache_stats["misses"] += 1
+        generation = _catalog_generation
 
-    
-    brand_match = _fuzzy_search_best(user_norm, CATALOG, "brand_norm", min_score=90)
-    if brand_match["ok"]:
-        brand_name = brand_match['result']['brand']
-        message = get_message("error_brand_only", lang).format(brand_name=brand_name)
-        return {"ok": False, "message": message}
+    # Read after the generation: a result from a replaced catalog is never cached.
+    catalog = CATALOG
+    result = _match_original(catalog, user_norm, lang)
 
-    
-    match = _fuzzy_search_best(user_norm, CATALOG, "display_norm", min_score=85)
-    if match["ok"]:
-        note = get_message("note_fuzzy_match", lang)
-        return {"ok": True, "original": match["result"], "note": note}
-    
-    
-    return {"ok": False, "message": get_message("error_not_found", lang)}
\ No newline at end of file
+    with _search_cache_lock:
+        if generation == _catalog_generation:
+            _search_cache[key] = result
+    return dict(result)
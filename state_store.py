@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+import database
+from database import pooled_connection
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_MAXSIZE = int(os.getenv("STATE_MAXSIZE", 100000))
+SEARCH_STATE_TTL = int(os.getenv("SEARCH_STATE_TTL", 3600))
+LANG_TTL = int(os.getenv("LANG_TTL", 90 * 24 * 3600))
+PURGE_INTERVAL = 600
+
+class MemoryStateStore:
+    """
+    Per-process LRU with a TTL per entry, for a single worker. Exposes the
+    get / [] = / pop subset of dict that the handlers use, plus aget / aset /
+    apop for the asyncio entry point.
+    """
+    def __init__(self, namespace, ttl, maxsize=STATE_MAXSIZE):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chat_id, default=None):
+        with self._lock:
+            item = self._items.get(chat_id)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._items[chat_id]
+                return default
+            self._items.move_to_end(chat_id)
+            return value
+
+    def __setitem__(self, chat_id, value):
+        with self._lock:
+            self._items[chat_id] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(chat_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, chat_id, default=None):
+        with self._lock:
+            item = self._items.pop(chat_id, None)
+        if item is None or item[1] <= time.monotonic():
+            return default
+        return item[0]
+
+    def __len__(self):
+        return len(self._items)
+
+    async def aget(self, chat_id, default=None):
+        return self.get(chat_id, default)
+
+    async def aset(self, chat_id, value):
+        self[chat_id] = value
+
+    async def apop(self, chat_id, default=None):
+        return self.pop(chat_id, default)
+
+class PostgresStateStore:
+    """
+    Shared UserState table, so every gunicorn worker sees the same state.
+    Expired rows are ignored on read and purged every PURGE_INTERVAL seconds.
+    The async methods run the same queries in a thread, so waiting for a pool
+    slot or a round-trip never blocks the event loop.
+    """
+    def __init__(self, namespace, ttl):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._last_purge = 0.0
+
+    def get(self, chat_id, default=None):
+        with pooled_connection() as conn:
+            value = database.fetch_user_state(conn, self.namespace, chat_id)
+        return default if value is None else value
+
+    def __setitem__(self, chat_id, value):
+        with pooled_connection() as conn:
+            database.save_user_state(conn, self.namespace, chat_id, value, self.ttl)
+            if time.monotonic() - self._last_purge > PURGE_INTERVAL:
+                self._last_purge = time.monotonic()
+                database.purge_user_states(conn)
+
+    def pop(self, chat_id, default=None):
+        with pooled_connection() as conn:
+            value = database.delete_user_state(conn, self.namespace, chat_id)
+        return default if value is None else value
+
+    def __len__(self):
+        with pooled_connection() as conn:
+            return database.count_user_states(conn, self.namespace)
+
+    async def aget(self, chat_id, default=None):
+        return await asyncio.to_thread(self.get, chat_id, default)
+
+    async def aset(self, chat_id, value):
+        await asyncio.to_thread(self.__setitem__, chat_id, value)
+
+    async def apop(self, chat_id, default=None):
+        return await asyncio.to_thread(self.pop, chat_id, default)
+
+STATE_BACKENDS = {"memory": MemoryStateStore, "postgres": PostgresStateStore}
+
+def create_state_store(namespace, ttl, backend=None):
+    """
+    Store selected by STATE_BACKEND: "memory" for one process, "postgres" when
+    updates of one user can reach different workers.
+    """
+    backend = backend or STATE_BACKEND
+    if backend not in STATE_BACKENDS:
+        raise ValueError(f"Неизвестный STATE_BACKEND: {backend}")
+    return STATE_BACKENDS[backend](namespace, ttl)
+
+def get_state_store_stats(*stores):
+    """"""
+    return {"backend": STATE_BACKEND, **{store.namespace: len(store) for store in stores}}
@@ -0,0 +1,95 @@
+import os
+import time
+import queue
+import threading
+
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 8))
+UPDATE_QUEUE_MAXSIZE = int(os.getenv("UPDATE_QUEUE_MAXSIZE", 200))
+
+_handler = None
+_queues = [queue.Queue(maxsize=UPDATE_QUEUE_MAXSIZE) for _ in range(UPDATE_WORKERS)]
+_workers = []
+_workers_lock = threading.Lock()
+_stats = {"accepted": 0, "rejected": 0, "processed": 0, "failed": 0,
+          "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+_stats_lock = threading.Lock()
+
+def set_update_handler(handler):
+    """handler(updates) is called with a one-element list, like bot.process_new_updates."""
+    global _handler
+    _handler = handler
+
+def _chat_key(update):
+    """
+    Updates of one chat always land on the same worker, so they are handled in
+    the order Telegram sent them.
+    """
+    for field in ("message", "edited_message", "channel_post"):
+        message = getattr(update, field, None)
+        if message is not None:
+            return message.chat.id
+    call = getattr(update, "callback_query", None)
+    if call is not None and call.message is not None:
+        return call.message.chat.id
+    if call is not None:
+        return call.from_user.id
+    return update.update_id
+
+def _run(updates):
+    while True:
+        update, queued_at = updates.get()
+        waited = (time.monotonic() - queued_at) * 1000
+        try:
+            _handler([update])
+            outcome = "processed"
+        except Exception as e:
+            print(f"❌ Ошибка обработки update {update.update_id}: {e}")
+            outcome = "failed"
+        with _stats_lock:
+            _stats[outcome] += 1
+            _stats["wait_ms_total"] += waited
+            _stats["wait_ms_max"] = max(_stats["wait_ms_max"], waited)
+
+def _ensure_workers():
+    if len(_workers) == UPDATE_WORKERS and all(t.is_alive() for t in _workers):
+        return
+    with _workers_lock:
+        for i, updates in enumerate(_queues):
+            if i < len(_workers) and _workers[i].is_alive():
+                continue
+            worker = threading.Thread(target=_run, args=(updates,), name=f"update-worker-{i}", daemon=True)
+            worker.start()
+            if i < len(_workers):
+                _workers[i] = worker
+            else:
+                _workers.append(worker)
+
+def submit_update(update):
+    """
+    Queues an update for its chat's worker. Returns False when that worker is
+    full, so the caller can ask Telegram to retry later.
+    """
+    if _handler is None:
+        raise RuntimeError("set_update_handler() must be called before submit_update().")
+    _ensure_workers()
+    updates = _queues[hash(_chat_key(update)) % UPDATE_WORKERS]
+    try:
+        updates.put_nowait((update, time.monotonic()))
+    except queue.Full:
+        with _stats_lock:
+            _stats["rejected"] += 1
+        return False
+    with _stats_lock:
+        _stats["accepted"] += 1
+    return True
+
+def get_update_queue_stats():
+    """"""
+    depths = [updates.qsize() for updates in _queues]
+    with _stats_lock:
+        stats = dict(_stats)
+    done = stats["processed"] + stats["failed"]
+    stats["wait_ms_avg"] = stats.pop("wait_ms_total") / done if done else 0.0
+    stats["depth"] = sum(depths)
+    stats["depth_max_worker"] = max(depths)
+    return stats
@@ -1,20 +1,34 @@
 import re, unicodedata
+from functools import lru_cache
 
-def normalize_for_match(s: str) -> str:
+_WHITESPACE_RE = re.compile(r"\s+")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s]")
+
+_CYRILLIC_TABLE = str.maketrans({
+    "а":"a","б":"b","в":"v","г":"g","д":"d","е":"e","ё":"e","ж":"zh","з":"z","и":"i","й":"i",
+    "к":"k","л":"l","м":"m","н":"n","о":"o","п":"p","р":"r","с":"s","т":"t","у":"u","ф":"f",
+    "х":"kh","ц":"ts","ч":"ch","ш":"sh","щ":"shch","ъ":"","ы":"y","ь":"","э":"e","ю":"yu","я":"ya"
+})
+
+# Only catalog-sized strings are memoized: user text can be up to 4096
+# characters and every distinct message would otherwise stay pinned.
+NORMALIZE_CACHE_MAXSIZE = 8192
+NORMALIZE_CACHE_MAX_LEN = 128
+
+def _normalize(s: str) -> str:
     if not s:
         return ""
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _WHITESPACE_RE.sub(" ", s).strip()
     s = unicodedata.normalize("NFKD", s)
-    s = "".join(ch for ch in s if not unicodedata.combining(ch))
-    table = {
-        "а":"a","б":"b","в":"v","г":"g","д":"d","е":"e","ё":"e","ж":"zh","з":"z","и":"i","й":"i",
-        "к":"k","л":"l","м":"m","н":"n","о":"o","п":"p","р":"r","с":"s","т":"t","у":"u","ф":"f",
-        "х":"kh","ц":"ts","ч":"ch","ш":"sh","щ":"shch","ъ":"","ы":"y","ь":"","э":"e","ю":"yu","я":"ya"
-    }
-    s_low = s.lower()
-    res = []
-    for ch in s_low:
-        res.append(table.get(ch, ch))
-    s = "".join(res)
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    return re.sub(r"\s+", " ", s).strip()
\ No newline at end of file
+    if not s.isascii():
+        s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    s = s.lower().translate(_CYRILLIC_TABLE)
+    s = _NON_ALNUM_RE.sub(" ", s)
+    return _WHITESPACE_RE.sub(" ", s).strip()
+
+_normalize_cached = lru_cache(maxsize=NORMALIZE_CACHE_MAXSIZE)(_normalize)
+
+def normalize_for_match(s: str) -> str:
+    if s and len(s) <= NORMALIZE_CACHE_MAX_LEN:
+        return _normalize_cached(s)
+    return _normalize(s)
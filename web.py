@@ -1,41 +1,92 @@
 import os
 import time
-from flask import Flask, request
+import signal
+import threading
+from flask import Flask, request, jsonify
 import telebot
 from dotenv import load_dotenv
 
-from database import get_connection, get_copies_by_original_id, log_message, init_db_if_not_exists, fetch_random_original
-from search import find_original, _load_catalog
-from formatter import format_response, format_popular_list, format_history_list
+from database import pooled_connection, init_db_if_not_exists
+from search import get_search_cache_stats, _load_catalog
+from search import request_catalog_reload, start_catalog_watcher
 from i18n import DEFAULT_LANG, get_message
-from cache import get_cached_popular_perfumes, get_cached_user_history
+from cache import get_cached_popular_perfumes, get_cached_user_history, get_cache_stats
+from log_writer import enqueue_log, get_log_queue_stats, start_partition_maintainer
+from update_queue import set_update_handler, submit_update, get_update_queue_stats
+from dedup import is_duplicate_update, forget_update, get_dedup_stats
+from followup import set_followup_sender, schedule_followup, cancel_followup, get_followup_stats
+from state_store import create_state_store, get_state_store_stats, LANG_TTL, SEARCH_STATE_TTL
 import keyboards
+import outbox
+import replies
+from outbox import set_outbox_bot, get_outbox_stats
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+ADMIN_IDS = {int(i) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()}
 
 if not BOT_TOKEN or not WEBHOOK_URL:
     raise ValueError("BOT_TOKEN и WEBHOOK_URL должны быть установлены!")
 
-bot = telebot.TeleBot(BOT_TOKEN)
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+set_update_handler(bot.process_new_updates)
+set_outbox_bot(bot)
+set_followup_sender(outbox.send_message)
 app = Flask(__name__)
 
-try:
-    conn = get_connection()
-    init_db_if_not_exists(conn)
-    print("Загрузка каталога в память...")
-    _load_catalog(conn)
-    print("✅ Каталог успешно загружен.")
-    bot.set_webhook(url=WEBHOOK_URL)
-    print(f"✅ Webhook установлен на URL: {WEBHOOK_URL}")
-except Exception as e:
-    error_msg = f"FATAL ERROR: Не удалось инициализировать бота: {e}"
-    print(error_msg)
-    raise
-
-user_language_map = {}
-user_states = {}
+_initialized = False
+_init_lock = threading.Lock()
+
+def init_app():
+    """
+    Creates the schema, loads the catalog and sets the webhook, once per
+    process tree: in the gunicorn master when preloading (see gunicorn.conf.py),
+    so forked workers share the catalog, otherwise on the first request.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        try:
+            with pooled_connection() as conn:
+                init_db_if_not_exists(conn)
+                print("Загрузка каталога в память...")
+                _load_catalog(conn)
+            print("✅ Каталог успешно загружен.")
+            bot.set_webhook(url=WEBHOOK_URL)
+            print(f"✅ Webhook установлен на URL: {WEBHOOK_URL}")
+        except Exception as e:
+            error_msg = f"FATAL ERROR: Не удалось инициализировать бота: {e}"
+            print(error_msg)
+            raise
+        _initialized = True
+
+def start_worker():
+    """Per-process startup. Threads do not survive fork, so this runs in each worker."""
+    start_catalog_watcher()
+    start_partition_maintainer()
+
+def install_signal_handlers():
+    """"""
+    try:
+        signal.signal(signal.SIGHUP, lambda signum, frame: request_catalog_reload(bump=True))
+    except ValueError:
+        pass
+
+def create_app():
+    """App factory for `gunicorn "web:create_app()"`."""
+    init_app()
+    return app
+
+@app.before_request
+def _ensure_initialized():
+    if not _initialized:
+        init_app()
+        start_worker()
+
+user_language_map = create_state_store("lang", LANG_TTL)
+user_states = create_state_store("search", SEARCH_STATE_TTL)
 
 def get_user_lang(chat_id):
     return user_language_map.get(chat_id, DEFAULT_LANG)
@@ -45,52 +96,34 @@ def send_menu(message):
     chat_id = message.chat.id
     lang = get_user_lang(chat_id)
     user_states.pop(chat_id, None)
-    log_message(conn, chat_id, message.text, 'start_command')
-    
-    welcome_msg = get_message("welcome", lang)
-    menu_text = get_message("menu_main_text", lang)
-    
-    bot.send_message(chat_id, f"{welcome_msg}\n\n{menu_text}", 
-                     reply_markup=keyboards.main_menu(lang), 
-                     parse_mode='Markdown')
+    enqueue_log(chat_id, message.text, 'start_command')
+    text, kwargs = replies.menu_reply(lang)
+    outbox.send_message(chat_id, text, **kwargs)
+
+@bot.message_handler(commands=['reload_catalog'], func=lambda msg: msg.from_user.id in ADMIN_IDS)
+def reload_catalog_command(message):
+    request_catalog_reload(bump=True)
+    outbox.reply_to(message, "Перезагрузка каталога запущена.")
 
 def show_search_prompt(chat_id, lang):
     user_states[chat_id] = "awaiting_search_input"
-    prompt_text = get_message("search_prompt", lang)
-    bot.send_message(chat_id, prompt_text, 
-                     reply_markup=keyboards.back_to_menu(lang),
-                     parse_mode='Markdown')
+    text, kwargs = replies.search_prompt_reply(lang)
+    outbox.send_message(chat_id, text, **kwargs)
 
 def show_popular(chat_id, lang):
     user_states.pop(chat_id, None)
-    popular_perfumes = get_cached_popular_perfumes()
-    response = format_popular_list(popular_perfumes, lang)
-    bot.send_message(chat_id, response, 
-                     reply_markup=keyboards.back_to_menu(lang),
-                     parse_mode='Markdown')
+    text, kwargs = replies.popular_reply(get_cached_popular_perfumes(), lang)
+    outbox.send_message(chat_id, text, **kwargs)
 
 def show_history(chat_id, lang):
     user_states.pop(chat_id, None)
-    history_items = get_cached_user_history(chat_id)
-    response = format_history_list(history_items, lang)
-    bot.send_message(chat_id, response, 
-                     reply_markup=keyboards.back_to_menu(lang),
-                     parse_mode='Markdown')
+    text, kwargs = replies.history_reply(get_cached_user_history(chat_id), lang)
+    outbox.send_message(chat_id, text, **kwargs)
 
 def show_random(chat_id, lang):
     user_states.pop(chat_id, None)
-    original = fetch_random_original(conn)
-    if not original:
-        bot.send_message(chat_id, "Sorry, I couldn't find any perfume.", reply_markup=keyboards.after_random_menu(lang))
-        return
-
-    copies = get_copies_by_original_id(conn, original["id"])
-    response_text = format_response(original, copies, lang)
-    title = get_message("random_title", lang)
-    bot.send_message(chat_id, f"**{title}**\n\n{response_text}",
-                     parse_mode='Markdown',
-                     disable_web_page_preview=True,
-                     reply_markup=keyboards.after_random_menu(lang))
+    text, kwargs = replies.random_reply(chat_id, lang)
+    outbox.send_message(chat_id, text, **kwargs)
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('lang:'))
@@ -103,18 +136,19 @@ def handle_language_change(call):
     bot.answer_callback_query(call.id, text=confirm_msg)
     
     menu_text = get_message("menu_main_text", new_lang)
-    bot.edit_message_text(menu_text, chat_id, call.message.message_id,
-                          reply_markup=keyboards.main_menu(new_lang),
-                          parse_mode='Markdown')
+    outbox.edit_message_text(menu_text, chat_id, call.message.message_id,
+                             reply_markup=keyboards.main_menu(new_lang),
+                             parse_mode='Markdown')
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith('main:'))
 def handle_main_menu(call):
     chat_id = call.message.chat.id
     action = call.data.split(':')[1]
     lang = get_user_lang(chat_id)
+    cancel_followup(chat_id)
     bot.answer_callback_query(call.id)
 
-    bot.delete_message(chat_id, call.message.message_id)
+    outbox.delete_message(chat_id, call.message.message_id)
 
     if action == 'menu':
         send_menu(call.message)
@@ -130,60 +164,52 @@ def handle_main_menu(call):
 @bot.message_handler(func=lambda msg: True)
 def handle_message(msg):
     chat_id = msg.chat.id
-    user_text = msg.text.strip()
     lang = get_user_lang(chat_id)
+    cancel_followup(chat_id)
 
     if user_states.get(chat_id) != "awaiting_search_input":
         send_menu(msg)
         return
 
-    if not user_text:
-        error_msg = get_message("error_empty_query", lang)
-        log_message(conn, msg.chat.id, msg.text, 'fail', 'Empty query')
-        bot.reply_to(msg, error_msg, parse_mode='Markdown') 
-        return
-
-    result = find_original(conn, user_text, lang=lang) 
-
-    if not result["ok"]:
-        log_message(conn, msg.chat.id, msg.text, 'fail', result['message'])
-        bot.reply_to(msg, result['message'], parse_mode='Markdown') 
-        return
-
-    user_states.pop(chat_id, None)
-    original = result["original"]
-    copies = get_copies_by_original_id(conn, original["id"])
-    
-    log_note = f"Found: {original['brand']} {original['name']}"
-    if 'note' in result:
-        log_note += f" | NOTE: {result['note']}" 
-        
-    log_message(conn, msg.chat.id, msg.text, 'success', log_note)
-    
-    response_text = format_response(original, copies, lang=lang)
-    
-    if 'note' in result:
-        note_prefix = get_message("response_note_prefix", lang)
-        response_text = f"{note_prefix}{result['note']} \n\n" + response_text 
-        
-    bot.reply_to(msg, 
-                 response_text, 
-                 parse_mode='Markdown', 
-                 disable_web_page_preview=True,
-                 reply_markup=keyboards.after_search_menu(lang))
+    found, text, kwargs = replies.search_reply(msg, lang)
+    if found:
+        user_states.pop(chat_id, None)
+    outbox.reply_to(msg, text, **kwargs)
+    if found:
+        schedule_followup(chat_id, lang)
 
 
 @app.route("/", methods=["GET"])
 def index():
     return "Perfume Bot is running!", 200
 
+@app.route("/stats", methods=["GET"])
+def stats():
+    return jsonify(
+        updates=get_update_queue_stats(),
+        dedup=get_dedup_stats(),
+        outbox=get_outbox_stats(),
+        followups=get_followup_stats(),
+        states=get_state_store_stats(user_states, user_language_map),
+        logs=get_log_queue_stats(),
+        search_cache=get_search_cache_stats(),
+        cache=get_cache_stats(),
+    )
+
 @app.route("/webhook", methods=["POST"])
 def webhook():
     json_str = request.get_data().decode("utf-8")
     update = telebot.types.Update.de_json(json_str)
-    bot.process_new_updates([update])
+    if is_duplicate_update(update.update_id):
+        return "!", 200
+    if not submit_update(update):
+        forget_update(update.update_id)
+        return "busy", 503
     return "!", 200
 
 if __name__ == '__main__':
+    init_app()
+    start_worker()
+    install_signal_handlers()
     port = int(os.getenv("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,303 @@
+import os
+import time
+import signal
+import asyncio
+from aiohttp import web
+from cachetools import TTLCache
+import telebot
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+from dotenv import load_dotenv
+
+import database_async
+from database import pooled_connection, init_db_if_not_exists
+from search import get_search_cache_stats, _load_catalog
+from search import request_catalog_reload, start_catalog_watcher
+from i18n import DEFAULT_LANG, get_message
+from cache import HISTORY_CACHE_TTL, HISTORY_CACHE_MAXSIZE, POPULAR_CACHE_TTL, POPULAR_STALE_TTL
+from log_writer import enqueue_log, get_log_queue_stats, add_flush_listener, start_partition_maintainer
+from update_queue import _chat_key
+from dedup import is_duplicate_update, forget_update, get_dedup_stats
+from followup import set_followup_sender, aschedule_followup, acancel_followup, get_followup_stats
+from state_store import create_state_store, get_state_store_stats, LANG_TTL, SEARCH_STATE_TTL
+import keyboards
+import outbox
+import replies
+from outbox import set_outbox_bot, get_outbox_stats
+
+load_dotenv()
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+ADMIN_IDS = {int(i) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()}
+MAX_INFLIGHT_UPDATES = int(os.getenv("MAX_INFLIGHT_UPDATES", 5000))
+
+if not BOT_TOKEN or not WEBHOOK_URL:
+    raise ValueError("BOT_TOKEN и WEBHOOK_URL должны быть установлены!")
+
+bot = AsyncTeleBot(BOT_TOKEN)
+# Replies go through the same throttled outbox as web.py; its worker threads
+# make the calls with a blocking client.
+set_outbox_bot(telebot.TeleBot(BOT_TOKEN, threaded=False))
+set_followup_sender(outbox.send_message)
+
+user_language_map = create_state_store("lang", LANG_TTL)
+user_states = create_state_store("search", SEARCH_STATE_TTL)
+
+_popular_cache = {}
+_history_cache = TTLCache(maxsize=HISTORY_CACHE_MAXSIZE, ttl=HISTORY_CACHE_TTL)
+# Everything below runs on the event loop thread, so no locks are needed.
+_loading = {}
+_refreshes = set()
+
+_inflight = set()
+_chat_locks = {}
+_stats = {"accepted": 0, "rejected": 0, "failed": 0}
+
+async def get_user_lang(chat_id):
+    return await user_language_map.aget(chat_id, DEFAULT_LANG)
+
+async def _single_flight(key, load, store):
+    """
+    cache._single_flight for the event loop: concurrent misses for one key
+    await a single load(), and store(value) is skipped when the key was
+    invalidated while loading.
+    """
+    call = _loading.get(key)
+    if call is not None:
+        return await asyncio.shield(call["done"])
+    done = asyncio.get_running_loop().create_future()
+    done.add_done_callback(lambda f: f.cancelled() or f.exception())
+    call = _loading[key] = {"done": done, "stale": False}
+    try:
+        value = await load()
+        if not call["stale"]:
+            store(value)
+        done.set_result(value)
+        return value
+    except Exception as e:
+        done.set_exception(e)
+        raise
+    finally:
+        _loading.pop(key, None)
+        if not done.done():
+            done.cancel()
+
+async def _load_popular(limit):
+    def store(value):
+        _popular_cache[limit] = (value, time.monotonic())
+    return await _single_flight(("popular", limit), lambda: database_async.fetch_popular_originals(limit), store)
+
+async def _refresh_popular(limit):
+    try:
+        await _load_popular(limit)
+    except Exception as e:
+        print(f"❌ Не удалось обновить популярные ароматы: {e}")
+
+async def get_popular_perfumes(limit: int = 10):
+    """
+    Fresh for POPULAR_CACHE_TTL seconds. Until POPULAR_STALE_TTL the old list
+    is still served while one background task reloads it.
+    """
+    entry = _popular_cache.get(limit)
+    if entry is not None:
+        value, loaded_at = entry
+        age = time.monotonic() - loaded_at
+        if age < POPULAR_CACHE_TTL:
+            return value
+        if age < POPULAR_STALE_TTL:
+            if ("popular", limit) not in _loading:
+                task = asyncio.create_task(_refresh_popular(limit))
+                _refreshes.add(task)
+                task.add_done_callback(_refreshes.discard)
+            return value
+    return await _load_popular(limit)
+
+async def get_user_history(user_id: int):
+    if user_id in _history_cache:
+        return _history_cache[user_id]
+
+    def store(history):
+        _history_cache[user_id] = history
+
+    return await _single_flight(("history", user_id), lambda: database_async.fetch_user_history(user_id), store)
+
+@bot.message_handler(commands=['start', 'menu', 'help'])
+async def send_menu(message):
+    chat_id = message.chat.id
+    lang = await get_user_lang(chat_id)
+    await user_states.apop(chat_id, None)
+    enqueue_log(chat_id, message.text, 'start_command')
+    text, kwargs = replies.menu_reply(lang)
+    outbox.send_message(chat_id, text, **kwargs)
+
+@bot.message_handler(commands=['reload_catalog'], func=lambda msg: msg.from_user.id in ADMIN_IDS)
+async def reload_catalog_command(message):
+    request_catalog_reload(bump=True)
+    outbox.reply_to(message, "Перезагрузка каталога запущена.")
+
+async def show_search_prompt(chat_id, lang):
+    await user_states.aset(chat_id, "awaiting_search_input")
+    text, kwargs = replies.search_prompt_reply(lang)
+    outbox.send_message(chat_id, text, **kwargs)
+
+async def show_popular(chat_id, lang):
+    await user_states.apop(chat_id, None)
+    text, kwargs = replies.popular_reply(await get_popular_perfumes(), lang)
+    outbox.send_message(chat_id, text, **kwargs)
+
+async def show_history(chat_id, lang):
+    await user_states.apop(chat_id, None)
+    text, kwargs = replies.history_reply(await get_user_history(chat_id), lang)
+    outbox.send_message(chat_id, text, **kwargs)
+
+async def show_random(chat_id, lang):
+    await user_states.apop(chat_id, None)
+    text, kwargs = replies.random_reply(chat_id, lang)
+    outbox.send_message(chat_id, text, **kwargs)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('lang:'))
+async def handle_language_change(call):
+    chat_id = call.message.chat.id
+    new_lang = call.data.split(':')[1]
+    await user_language_map.aset(chat_id, new_lang)
+
+    confirm_msg = get_message("confirm_lang_set", new_lang)
+    await bot.answer_callback_query(call.id, text=confirm_msg)
+
+    menu_text = get_message("menu_main_text", new_lang)
+    outbox.edit_message_text(menu_text, chat_id, call.message.message_id,
+                             reply_markup=keyboards.main_menu(new_lang),
+                             parse_mode='Markdown')
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('main:'))
+async def handle_main_menu(call):
+    chat_id = call.message.chat.id
+    action = call.data.split(':')[1]
+    lang = await get_user_lang(chat_id)
+    await acancel_followup(chat_id)
+    await bot.answer_callback_query(call.id)
+
+    outbox.delete_message(chat_id, call.message.message_id)
+
+    if action == 'menu':
+        await send_menu(call.message)
+    elif action == 'search':
+        await show_search_prompt(chat_id, lang)
+    elif action == 'popular':
+        await show_popular(chat_id, lang)
+    elif action == 'history':
+        await show_history(chat_id, lang)
+    elif action == 'random':
+        await show_random(chat_id, lang)
+
+@bot.message_handler(func=lambda msg: True)
+async def handle_message(msg):
+    chat_id = msg.chat.id
+    lang = await get_user_lang(chat_id)
+    await acancel_followup(chat_id)
+
+    if await user_states.aget(chat_id) != "awaiting_search_input":
+        await send_menu(msg)
+        return
+
+    found, text, kwargs = replies.search_reply(msg, lang)
+    if found:
+        await user_states.apop(chat_id, None)
+    outbox.reply_to(msg, text, **kwargs)
+    if found:
+        await aschedule_followup(chat_id, lang)
+
+
+async def _process_update(update):
+    """
+    Updates of one chat are processed one after another, different chats run
+    concurrently on the event loop.
+    """
+    chat_id = _chat_key(update)
+    entry = _chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            await bot.process_new_updates([update])
+    except Exception as e:
+        _stats["failed"] += 1
+        print(f"❌ Ошибка обработки update {update.update_id}: {e}")
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            _chat_locks.pop(chat_id, None)
+
+async def index(request):
+    return web.Response(text="Perfume Bot is running!")
+
+async def stats(request):
+    return web.json_response({
+        "updates": {**_stats, "inflight": len(_inflight)},
+        "dedup": get_dedup_stats(),
+        "outbox": get_outbox_stats(),
+        "followups": await asyncio.to_thread(get_followup_stats),
+        "states": await asyncio.to_thread(get_state_store_stats, user_states, user_language_map),
+        "logs": get_log_queue_stats(),
+        "search_cache": get_search_cache_stats(),
+    })
+
+async def webhook(request):
+    update = types.Update.de_json(await request.text())
+    if await asyncio.to_thread(is_duplicate_update, update.update_id):
+        return web.Response(text="!")
+    if len(_inflight) >= MAX_INFLIGHT_UPDATES:
+        _stats["rejected"] += 1
+        await asyncio.to_thread(forget_update, update.update_id)
+        return web.Response(text="busy", status=503)
+    task = asyncio.create_task(_process_update(update))
+    _inflight.add(task)
+    task.add_done_callback(_inflight.discard)
+    _stats["accepted"] += 1
+    return web.Response(text="!")
+
+def _init_catalog():
+    with pooled_connection() as conn:
+        init_db_if_not_exists(conn)
+        print("Загрузка каталога в память...")
+        _load_catalog(conn)
+    print("✅ Каталог успешно загружен.")
+    start_catalog_watcher()
+
+def _forget_history(rows):
+    for user_id in {row[0] for row in rows if row[3] == "success"}:
+        _history_cache.pop(user_id, None)
+        call = _loading.get(("history", user_id))
+        if call is not None:
+            call["stale"] = True
+
+async def on_startup(app):
+    loop = asyncio.get_running_loop()
+    add_flush_listener(lambda rows: loop.call_soon_threadsafe(_forget_history, rows))
+    try:
+        await asyncio.to_thread(_init_catalog)
+        start_partition_maintainer()
+        loop.add_signal_handler(signal.SIGHUP, request_catalog_reload, True)
+        await database_async.get_async_pool()
+        await bot.set_webhook(url=WEBHOOK_URL)
+        print(f"✅ Webhook установлен на URL: {WEBHOOK_URL}")
+    except Exception as e:
+        print(f"FATAL ERROR: Не удалось инициализировать бота: {e}")
+        raise
+
+async def on_cleanup(app):
+    if _inflight or _refreshes:
+        await asyncio.gather(*_inflight, *_refreshes, return_exceptions=True)
+    await database_async.close_async_pool()
+    await bot.close_session()
+
+app = web.Application()
+app.router.add_get("/", index)
+app.router.add_get("/stats", stats)
+app.router.add_post("/webhook", webhook)
+app.on_startup.append(on_startup)
+app.on_cleanup.append(on_cleanup)
+
+if __name__ == '__main__':
+    port = int(os.getenv("PORT", 5000))
+    web.run_app(app, host='0.0.0.0', port=port)